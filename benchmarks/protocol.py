@@ -0,0 +1,282 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Protocol benchmarks
+
+Times every step of the issuing and verifying protocols, and both protocols
+end to end, over a grid of modulus sizes (ln), attribute counts (l) and
+disclosed-set sizes (d):
+
+    python -m benchmarks.protocol --ln 1024 2048 --attributes 3 5 --disclosed 0 1 all \\
+        --output results.json --baseline baseline.json
+
+ln sets the size of the issuer modulus; the other lengths are those of
+idemix.settings. Results are written as JSON, one entry per step, grid
+point and arithmetic backend with the median, percentiles and operations
+per second. The backend is the one selected by IDEMIX_BACKEND; --backends
+runs the grid once per backend, each in its own process. With --baseline
+the medians are compared to a previous output and the steps slower by
+more than --threshold are reported; the exit status is then 1. --seed
+draws every random number from idemix.utils.randomness.DeterministicRandomness,
+so that runs with --processes 1 compute the same keys and proofs.
+'''
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from idemix.issuer import Issuer
+from idemix.recipient import Recipient
+from idemix.settings import lm
+from idemix.utils import arith, randomness
+from idemix.utils.arith import integer
+from idemix.utils.randomness import randomBits
+from idemix.verifier import Verifier
+
+timer = time.time if sys.version_info[0] < 3 else time.perf_counter
+
+
+def summary(samples):
+    samples = sorted(samples)
+    n = len(samples)
+
+    def percentile(p):
+        return samples[min(n - 1, int(p * n / 100.0))]
+
+    median = samples[n // 2] if n % 2 else (samples[n // 2 - 1] + samples[n // 2]) / 2.0
+
+    return {'runs': n,
+            'min': samples[0],
+            'median': median,
+            'p90': percentile(90),
+            'p99': percentile(99),
+            'max': samples[-1],
+            'ops_per_sec': 1.0 / median if median else None}
+
+
+def timed(samples, name, fn, *args):
+    start = timer()
+    result = fn(*args)
+    samples.setdefault(name, []).append(timer() - start)
+
+    return result
+
+
+def bench_keys(ln, l, repeat, processes):
+    """Issuer.__init__ (safe primes) and gen_key_pair, returns the last issuer"""
+    samples = {}
+    context = integer(randomBits(lm))
+
+    for i in range(repeat):
+        issuer = timed(samples, 'issuer_init', Issuer, l, 0, 0, ln // 2 - 1, context, processes)
+
+    for i in range(repeat):
+        timed(samples, 'gen_key_pair', issuer.gen_key_pair)
+
+    return issuer, context, samples
+
+
+def bench_issuing(issuer, context, attr, repeat):
+    samples = {}
+    pk_i = issuer.pk_i
+
+    for i in range(repeat):
+        start = timer()
+
+        user = Recipient(pk_i, context)
+        user.gen_master_secret()
+        user.set_attributes(attr)
+
+        n1 = timed(samples, 'round_0', issuer.round_0)
+        p1, n2 = timed(samples, 'round_1', user.round_1, n1)
+        # round_2 without the per-session nonce lookup
+        signature, P2 = timed(samples, 'round_2', issuer.issue, p1['U'], p1, attr, n1, n2)
+        sig, q2Check, c2Check = timed(samples, 'round_3', user.round_3, signature, P2, n2)
+
+        samples.setdefault('issuing', []).append(timer() - start)
+
+        if not (q2Check and c2Check):
+            raise AssertionError('issuing failed')
+
+    return user, {'attributes': attr, 'signature': sig}, samples
+
+
+def bench_proving(user, verifier, credential, predicate, repeat):
+    samples = {}
+    disclosed = {'attributes': dict((id, credential['attributes'][id]) for id in predicate)}
+
+    for i in range(repeat):
+        start = timer()
+
+        nv = verifier.get_nonce()
+        proof = timed(samples, 'build_proof', user.build_proof, credential, predicate, nv)
+        valid = timed(samples, 'verifyProof', verifier.verifyProof, disclosed, predicate, proof, nv)
+
+        samples.setdefault('verifying', []).append(timer() - start)
+
+        if not valid:
+            raise AssertionError('proof not verified')
+
+    return samples
+
+
+def disclosed_sizes(values, l):
+    sizes = []
+    for value in values:
+        d = l if value == 'all' else int(value)
+        if d <= l and d not in sizes:
+            sizes.append(d)
+
+    return sizes
+
+
+def run(args):
+    results = {}
+
+    def add(params, samples):
+        params = [('backend', arith.name)] + params
+
+        for name, values in samples.items():
+            key = '%s[%s]' % (name, ','.join('%s=%s' % item for item in params))
+            results[key] = dict(summary(values), step=name, params=dict(params))
+            sys.stderr.write('%-40s median %10.3f ms\n' % (key, results[key]['median'] * 1000))
+
+    for ln in args.ln:
+        for l in args.attributes:
+            issuer, context, samples = bench_keys(ln, l, args.keygen_repeat, args.processes)
+            add([('ln', ln), ('l', l)], samples)
+
+            attr = dict((str(i), integer(randomBits(lm))) for i in range(1, l + 1))
+            user, credential, samples = bench_issuing(issuer, context, attr, args.repeat)
+            add([('ln', ln), ('l', l)], samples)
+
+            verifier = Verifier(issuer.pk_i, context)
+
+            for d in disclosed_sizes(args.disclosed, l):
+                predicate = [str(i) for i in range(1, d + 1)]
+                samples = bench_proving(user, verifier, credential, predicate, args.repeat)
+                add([('ln', ln), ('l', l), ('d', d)], samples)
+
+    return {'meta': {'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'repeat': args.repeat,
+                     'keygen_repeat': args.keygen_repeat,
+                     'seed': args.seed,
+                     'backends': [arith.name]},
+            'results': results}
+
+
+def run_backends(args):
+    """Runs the grid in a child process for every backend in args.backends and merges the results"""
+    argv = ['--ln'] + [str(ln) for ln in args.ln]
+    argv += ['--attributes'] + [str(l) for l in args.attributes]
+    argv += ['--disclosed'] + args.disclosed
+    argv += ['--repeat', str(args.repeat), '--keygen-repeat', str(args.keygen_repeat)]
+    if args.processes is not None:
+        argv += ['--processes', str(args.processes)]
+    if args.seed is not None:
+        argv += ['--seed', args.seed]
+
+    merged = None
+
+    for backend in args.backends:
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+
+        try:
+            env = dict(os.environ, IDEMIX_BACKEND=backend)
+            subprocess.check_call([sys.executable, '-m', 'benchmarks.protocol'] + argv + ['--output', path], env=env)
+
+            with open(path) as f:
+                results = json.load(f)
+        finally:
+            os.remove(path)
+
+        if merged is None:
+            merged = results
+        else:
+            merged['meta']['backends'] += results['meta']['backends']
+            merged['results'].update(results['results'])
+
+    return merged
+
+
+def compare(results, baseline, threshold):
+    """Returns (key, baseline median, median) for the steps that got slower"""
+    regressions = []
+
+    for key, entry in sorted(results['results'].items()):
+        old = baseline['results'].get(key)
+        if old is not None and entry['median'] > old['median'] * (1 + threshold):
+            regressions.append((key, old['median'], entry['median']))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Idemix protocol benchmarks')
+    parser.add_argument('--ln', type=int, nargs='+', default=[1024])
+    parser.add_argument('--attributes', type=int, nargs='+', default=[3, 5])
+    parser.add_argument('--disclosed', nargs='+', default=['0', '1', 'all'],
+                        help='disclosed-set sizes, or "all"')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--keygen-repeat', type=int, default=1)
+    parser.add_argument('--processes', type=int, default=None,
+                        help='processes for the safe prime search')
+    parser.add_argument('--seed', help='deterministic randomness seed, reproducible with --processes 1')
+    parser.add_argument('--backends', nargs='+', choices=sorted(arith.backends),
+                        help='arithmetic backends to compare')
+    parser.add_argument('--output', default='-', help='JSON output file, - for stdout')
+    parser.add_argument('--baseline', help='JSON output of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown of a median reported as a regression')
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        randomness.set_default(randomness.DeterministicRandomness(args.seed))
+
+    results = run_backends(args) if args.backends else run(args)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output == '-':
+        sys.stdout.write(text + '\n')
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.threshold)
+
+    for key, old, new in regressions:
+        sys.stderr.write('REGRESSION %s: %.3f ms -> %.3f ms (%+.0f%%)\n' %
+                         (key, old * 1000, new * 1000, (new / old - 1) * 100))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
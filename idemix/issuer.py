@@ -16,70 +16,89 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import hashlib
-
-from charm.core.math.integer import integer, isPrime, random, randomPrime, randomBits
-from charm.toolbox.conversion import Conversion
-from utils.commit_df02 import CM_DF02
-
-from idemix.settings import lm, lo, le, lv
+import multiprocessing
+
+from idemix.settings import lm, lo, le, lePrime, lv, secparam
+from idemix.utils import instrument, randomness
+from idemix.utils.arith import integer
+from idemix.utils.commit_df02 import CM_DF02
+from idemix.utils.fixed_base import subkey
+from idemix.utils.key_bundle import dump_key_bundle, load_key_bundle
+from idemix.utils.nonce import StatelessNonces
 from idemix.utils.pksig_cl03_idmx import Sig_CL03_Idmx
+from idemix.utils.prime_reservoir import PrimeReservoir
+from idemix.utils.safe_prime import safe_prime
+from idemix.utils.transcript import issuer_transcript
+from idemix.verifier import malformed
 
 
 class Issuer:
     'Idemix issuer'
 
-    def __init__(self, l, p, q, secparam, context):
+    def __init__(self, l, p, q, secparam, context, processes=None, rng=None):
         self.secparam = secparam
+        self.rng = randomness.get(rng)
         self.l = l
         self.context = context
 
         self.pksig = 0
+        self.pool = None
+        self.nonces = None
+        self.primes = None
+        self.prime_stats = []
 
         if (p == 0):
-            pprime = randomPrime(secparam)
-            while (not isPrime(2 * pprime + 1)):
-                pprime = randomPrime(secparam)
-
-            self.p = integer(2 * pprime + 1)
+            (self.p, stats) = safe_prime(secparam, processes, self.rng)
+            self.prime_stats.append(stats)
         else:
             self.p = p
 
         if (q == 0):
-            qprime = randomPrime(secparam)
-            while (not isPrime(2 * qprime + 1)):
-                qprime = randomPrime(secparam)
-
-            self.q = integer(2 * qprime + 1)
+            (self.q, stats) = safe_prime(secparam, processes, self.rng)
+            self.prime_stats.append(stats)
         else:
             self.q = q
 
+    @instrument.step('issuer.gen_key_pair')
     def gen_key_pair(self):
 
+        self.close_pool()
+
         self.pk_i = {}
         self.sk_i = {}
 
-        self.pksig = Sig_CL03_Idmx(lin=self.l)
+        self.pksig = Sig_CL03_Idmx(lin=self.l, primes=self.primes, rng=self.rng)
         (self.pk_i, self.sk_i) = self.pksig.keygen(self.p, self.q)
+        self.sk_i = self.pksig.precompute(self.sk_i)
 
         self.S = self.pk_i['S']
         self.Z = self.pk_i['Z']
         self.R = self.pk_i['R']
         self.N = self.pk_i['N']
 
-        self.Ro = self.pk_i['S'] ** integer(random(self.pk_i['N']))
+        self.Ro = instrument.modexp(self.pk_i['S'], self.rng.random(self.pk_i['N']), self.pk_i['N'])
         self.pk_i['Ro'] = self.Ro
 
+        self.transcript = issuer_transcript(self.context, self.pk_i)
+
         return (self.pk_i, self.sk_i)
 
     def set_key_pair(self, n_pk_i, n_sk_i):
 
+        self.close_pool()
+
         self.pk_i = n_pk_i
-        self.sk_i = n_sk_i
+        self.transcript = issuer_transcript(self.context, self.pk_i)
 
         self.l = len(n_pk_i['R'])
 
-        self.pksig = Sig_CL03_Idmx(lin=self.l)
+        self.pksig = Sig_CL03_Idmx(lin=self.l, primes=self.primes, rng=self.rng)
+
+        if 'qInv' in n_sk_i:
+            # already precomputed, e.g. loaded from a key bundle
+            self.sk_i = n_sk_i
+        else:
+            self.sk_i = self.pksig.precompute(n_sk_i)
 
     def signAttributes(self, attr):
         self.signature = self.pksig.sign(self.pk_i, self.sk_i, attr, 0, 0, 0)
@@ -98,21 +117,61 @@ class Issuer:
         mt = {}
 
         for i in range(1, self.l + 1):
-            mt[str(i)] = integer(randomBits(lm)) % self.pk_i['N']
+            mt[str(i)] = integer(self.rng.randomBits(lm)) % self.pk_i['N']
 
         signature = self.pksig.sign(self.pk_i, self.sk_i, mt)
 
         return self.verifySignature(mt, signature)
 
+    def use_stateless_nonces(self, key=None, ttl=300):
+        """
+        Switches to MAC-tagged round 0 nonces (see idemix.utils.nonce). Issuers
+        sharing the key accept each other's nonces, so round_2 can run on any
+        of them; it must then be given the nonce n1.
+        """
+        self.nonces = StatelessNonces(key, ttl, self.rng)
+
+        return self.nonces.key
+
+    def start_prime_reservoir(self, low=16, high=64, processes=1):
+        """
+        Keeps between low and high primes of the e interval ready, searched by
+        processes worker processes drawing their seeds from rng, for the
+        exponents e and the proof primes r of round 2. Returns the
+        PrimeReservoir.
+        """
+        self.stop_prime_reservoir()
+        self.primes = PrimeReservoir(le, low, high, processes, rng=self.rng)
+
+        if self.pksig:
+            self.pksig.primes = self.primes
+
+        return self.primes
+
+    def stop_prime_reservoir(self):
+        if self.primes is not None:
+            self.primes.stop()
+            self.primes = None
+
+        if self.pksig:
+            self.pksig.primes = None
+
+    def __prime(self):
+        return self.rng.randomPrime(le, lePrime) if self.primes is None else self.primes.take()
+
     def round_0(self):
-        self.n1 = integer(randomBits(lo))
+        if self.nonces is not None:
+            return self.nonces.new()
+
+        self.n1 = integer(self.rng.randomBits(lo))
 
         return self.n1
 
-    def __verify_p1(self, p1):
+    @instrument.step('issuer.verify_p1')
+    def __verify_p1(self, p1, n1):
 
-        df02_commit = CM_DF02()
-        pk_commit = {'S': self.pk_i['S'], 'Z': self.pk_i['Ro'], 'N': self.pk_i['N']}
+        df02_commit = CM_DF02(self.rng)
+        pk_commit = subkey(self.pk_i, S='S', Z='Ro')
 
         sHat = p1['sHat']
         vPrimeHat = p1['vPrimeHat']
@@ -121,65 +180,191 @@ class Issuer:
         U = p1['U'] % self.pk_i['N']
         c = p1['c']
 
-        Uhat = cA * (U ** (-1 * c))
-
-        s2 = hashlib.new('sha256')
-
-        s2.update(Conversion.IP2OS(self.context))
-        s2.update(Conversion.IP2OS(U))
-        s2.update(Conversion.IP2OS(Uhat))
-        s2.update(Conversion.IP2OS(self.n1))
+        Uhat = cA * instrument.modexp(U, -1 * c, self.pk_i['N']) % self.pk_i['N']
 
-        cHat = integer(s2.digest())
+        cHat = self.transcript.copy().append(U, Uhat, n1).challenge()
 
         return c == cHat
 
-    def round_2(self, U, p1, attr, n2):
-
-        if self.__verify_p1(p1):
-            pass
-            # print "P1 verified"
-        else:
+    def __session_nonce(self, n1):
+        """
+        Returns the nonce p1 is checked against, or None if n1 is not
+        accepted: with stateless nonces n1 must carry a valid tag, otherwise
+        it must be the last round 0 nonce, which is also the default.
+        """
+        if self.nonces is not None:
+            return n1 if n1 is not None and self.nonces.check(n1) else None
+
+        last = getattr(self, 'n1', None)
+        if n1 is not None and n1 != last:
             return None
 
-        e = randomPrime(le)
+        return last
 
-        vTilde = integer(randomBits(lv - 1))
-        vPrimePrime = (2 ** (lv - 1)) + vTilde
+    @instrument.step('issuer.round_2')
+    def round_2(self, U, p1, attr, n2, n1=None):
+        n1 = self.__session_nonce(n1)
+        if n1 is None:
+            return None
 
-        R = self.pk_i['R']
-        Cx = 1 % self.pk_i['N']
+        return self.issue(U, p1, attr, n1, n2)
 
-        for i in range(1, len(attr) + 1):
-            Cx = Cx * (R[str(i)] ** attr[str(i)])
+    @instrument.step('issuer.issue')
+    def issue(self, U, p1, attr, n1, n2):
+        """
+        Round 2 of the issuing protocol for the round 0 nonce n1. Unlike
+        round_2 it does not read or write any per-session state, so it is
+        safe to call for interleaved sessions.
+        """
 
-        sigA = self.signAttributesLong(attr, vPrimePrime, U, e)
+        if not self.__verify_p1(p1, n1):
+            return None
 
-        A = sigA['A']
-        Q = sigA['Q']
+        e = self.__prime()
 
-        phi_N = (self.sk_i['p'] - 1) * (self.sk_i['q'] - 1)
-        e2 = e % phi_N
+        vTilde = integer(self.rng.randomBits(lv - 1))
+        vPrimePrime = (2 ** (lv - 1)) + vTilde
 
-        r = randomPrime(le)
-        Atilde = (Q ** r) % self.pk_i['N']
+        sigA = self.pksig.sign(self.pk_i, self.sk_i, attr, v=vPrimePrime, u=U, e=e)
 
-        s3 = hashlib.new('sha256')
+        A = sigA['A']
+        Q = sigA['Q']
 
-        s3.update(Conversion.IP2OS(self.context))
-        s3.update(Conversion.IP2OS(Q))
-        s3.update(Conversion.IP2OS(A))
-        s3.update(Conversion.IP2OS(n2))
-        s3.update(Conversion.IP2OS(Atilde))
+        r = self.__prime()
+        Atilde = instrument.modexp(Q, r, self.pk_i['N'])
 
-        cPrime = integer(s3.digest())
-        e2Prime = e2 ** - 1
+        cPrime = self.transcript.copy().append(Q, A, n2, Atilde).challenge()
+        e2Prime = instrument.inverse(e, self.sk_i['phi_N'])
 
-        Se = r - (cPrime * integer(e2Prime))
+        Se = r - (cPrime * e2Prime)
 
         signature = {'A': A, 'e': e, 'vPrimePrime': vPrimePrime}
         P2 = {'Se': Se, 'cPrime': cPrime}
 
-        print signature
-        print P2
         return signature, P2
+
+    @instrument.step('issuer.round_2_batch')
+    def round_2_batch(self, requests, processes=None):
+        """
+        Round 2 for many requests at once, spread over a pool of worker
+        processes. Every request is a (p1, attr, n2) tuple, checked against
+        the last round 0 nonce, or a (p1, attr, n2, n1) tuple carrying its own
+        nonce, which is required with stateless nonces and must otherwise be
+        the last round 0 nonce. Returns the (signature, P2) pairs, or None
+        for the requests whose nonce or p1 does not verify or which are
+        malformed, in submission order.
+
+        The pool is started on the first call, with the key material loaded
+        once by every worker, and kept until close_pool() or a key change.
+
+        >>> from idemix.recipient import Recipient
+        >>> issuer = Issuer(3, 0, 0, 255, integer(1), processes=1)
+        >>> (pk_i, sk_i) = issuer.gen_key_pair()
+        >>> user = Recipient(pk_i, integer(1))
+        >>> user.gen_master_secret()
+        >>> attr = user.gen_random_attributes(3)
+        >>> old = issuer.round_0()
+        >>> (stale, n2_stale) = user.round_1(old)
+        >>> n1 = issuer.round_0()
+        >>> (p1, n2) = user.round_1(n1)
+        >>> broken = dict(p1, U=pk_i['N'])
+        >>> results = issuer.round_2_batch([(p1, attr, n2), (broken, attr, n2), (p1, {'1': None}, n2),
+        ...                                 (stale, attr, n2_stale, old), (p1, attr, n2, n1)], processes=1)
+        >>> [result is not None for result in results]
+        [True, False, False, False, True]
+        >>> (signature, P2) = results[0]
+        >>> user.round_3(signature, P2, n2)[1:]
+        (True, True)
+        >>> (issuer.round_2(stale['U'], stale, attr, n2_stale, old), issuer.round_2(stale['U'], stale, attr, n2_stale))
+        (None, None)
+        >>> issuer.close_pool()
+        """
+        if self.pool is None:
+            self.pool_size = processes or multiprocessing.cpu_count()
+            self.pool = multiprocessing.Pool(self.pool_size, _init_pool_worker,
+                                             (dump_key_bundle(self.pk_i, self.sk_i), int(self.context)))
+
+        jobs = []
+        for request in requests:
+            try:
+                p1, attr, n2 = request[:3]
+                n1 = self.__session_nonce(request[3] if len(request) > 3 else None)
+
+                jobs.append(None if n1 is None else _pool_job(p1, attr, n1, n2))
+            except malformed:
+                jobs.append(None)
+
+        chunksize = max(1, len(jobs) // (4 * self.pool_size))
+
+        N = self.pk_i['N']
+
+        return [_pool_result(result, N) for result in self.pool.map(_pool_issue, jobs, chunksize)]
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+# Worker side of Issuer.round_2_batch. The key is sent once as a key bundle,
+# the other values cross the process boundary as Python longs and the group
+# elements are reduced mod N again on arrival.
+
+_pool_issuer = None
+
+
+def _init_pool_worker(bundle, context):
+    global _pool_issuer
+
+    pk_i, sk_i = load_key_bundle(bundle)
+
+    _pool_issuer = Issuer(len(pk_i['R']), sk_i['p'], sk_i['q'], secparam, integer(context))
+    _pool_issuer.set_key_pair(pk_i, sk_i)
+
+
+def _pool_job(p1, attr, n1, n2):
+    return (dict((k, int(v)) for k, v in p1.items()),
+            dict((k, int(v)) for k, v in attr.items()),
+            int(n1), int(n2))
+
+
+def _pool_issue(job):
+    if job is None:
+        return None
+
+    # a request that fails on its own must not lose the results of the batch
+    try:
+        return _pool_issue_job(*job)
+    except malformed:
+        return None
+
+
+def _pool_issue_job(p1, attr, n1, n2):
+    N = _pool_issuer.pk_i['N']
+
+    p1 = {'c': integer(p1['c']), 'vPrimeHat': integer(p1['vPrimeHat']), 'sHat': integer(p1['sHat']),
+          'U': integer(p1['U']) % N}
+    attr = dict((id, integer(v)) for id, v in attr.items())
+
+    result = _pool_issuer.issue(p1['U'], p1, attr, integer(n1), integer(n2))
+
+    if result is None:
+        return None
+
+    signature, P2 = result
+
+    return (dict((k, int(v)) for k, v in signature.items()),
+            dict((k, int(v)) for k, v in P2.items()))
+
+
+def _pool_result(result, N):
+    if result is None:
+        return None
+
+    signature, P2 = result
+    signature = {'A': integer(signature['A']) % N, 'e': integer(signature['e']),
+                 'vPrimePrime': integer(signature['vPrimePrime'])}
+    P2 = {'Se': integer(P2['Se']), 'cPrime': integer(P2['cPrime'])}
+
+    return signature, P2
@@ -0,0 +1,268 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Asyncio issuer service (Python 3.7+)
+
+Uses the framing and status codes of idemix.verifier_service. Requests:
+
+    b'N'                        round 0, returns a nonce
+    b'I' + issue                round 2 for a wire-encoded 'issue' message
+                                {'p1': ..., 'attributes': ..., 'n1': ..., 'n2': ...}
+
+A VALID round 2 reply is followed by a wire-encoded 'issued' message
+{'signature': ..., 'P2': ...}.
+
+Round 0 nonces are MAC-tagged (idemix.utils.nonce), so services started
+with the same key and issuer key pair accept each other's nonces and keep
+no per-session state. The signing runs in a process pool; when queue_size
+requests are already pending new ones are answered BUSY.
+'''
+
+import asyncio
+import concurrent.futures
+
+from idemix.issuer import _init_pool_worker, _pool_issue, _pool_job, _pool_result
+from idemix.utils import wire
+from idemix.utils.key_bundle import dump_key_bundle
+from idemix.utils.nonce import StatelessNonces
+from idemix.verifier_service import frame_header, max_frame, INVALID, VALID, BUSY, BAD_REQUEST
+
+
+class IssuerService:
+    """
+    Idemix issuer service. authorize, if given, is called with the requested
+    attributes and returns the attributes to sign, or None to refuse.
+
+    >>> from idemix.issuer import Issuer
+    >>> from idemix.recipient import Recipient
+    >>> from idemix.utils.arith import integer
+    >>> issuer = Issuer(3, 0, 0, 255, integer(1), processes=1)
+    >>> (pk_i, sk_i) = issuer.gen_key_pair()
+    >>> user = Recipient(pk_i, integer(1))
+    >>> user.gen_master_secret()
+    >>> attr = user.gen_random_attributes(3)
+
+    Over loopback, round 0 on one service and round 2 on another sharing
+    the nonce key; a nonce with a bad tag, or made with another key, is
+    INVALID:
+
+    >>> async def issue():
+    ...     services = [IssuerService(pk_i, sk_i, integer(1), nonce_key=b'k' * 32, processes=1) for k in range(2)]
+    ...     clients = [await open_issuer_connection(*(await service.start()), pk_i=pk_i) for service in services]
+    ...     n1 = await clients[0].round_0()
+    ...     (p1, n2) = user.round_1(n1)
+    ...     (status, signature, P2) = await clients[1].round_2(p1, attr, n1, n2)
+    ...     forged = (await clients[1].round_2(p1, attr, n1 ^ 1, n2))[0]
+    ...     other = IssuerService(pk_i, sk_i, integer(1)).round_0()
+    ...     foreign = (await clients[1].round_2(p1, attr, other, n2))[0]
+    ...     for client in clients:
+    ...         client.close()
+    ...     for service in services:
+    ...         await service.close()
+    ...     return status, user.round_3(signature, P2, n2)[1:], forged, foreign
+    >>> asyncio.run(issue()) == (VALID, (True, True), INVALID, INVALID)
+    True
+
+    Frames that are not a request, or whose message cannot be decoded, are
+    answered BAD_REQUEST and the connection stays usable:
+
+    >>> async def malformed():
+    ...     service = IssuerService(pk_i, sk_i, integer(1), processes=1)
+    ...     (reader, writer) = await asyncio.open_connection(*(await service.start()))
+    ...     replies = []
+    ...     for frame in (b'I' + b'garbage', b'X', b'N'):
+    ...         writer.write(frame_header.pack(len(frame)) + frame)
+    ...         (length,) = frame_header.unpack(await reader.readexactly(frame_header.size))
+    ...         replies.append((await reader.readexactly(length))[0])
+    ...     writer.close()
+    ...     await service.close()
+    ...     return replies
+    >>> asyncio.run(malformed()) == [BAD_REQUEST, BAD_REQUEST, VALID]
+    True
+
+    Once queue_size round 2 requests are being signed, the next one is
+    answered BUSY:
+
+    >>> async def busy():
+    ...     service = IssuerService(pk_i, sk_i, integer(1), processes=1, queue_size=1)
+    ...     await service.start()
+    ...     requests = []
+    ...     for k in range(2):
+    ...         n1 = service.round_0()
+    ...         requests.append(user.round_1(n1) + (n1,))
+    ...     results = await asyncio.gather(*[service.round_2(p1, attr, n1, n2) for p1, n2, n1 in requests])
+    ...     await service.close()
+    ...     return [status for status, signature, P2 in results]
+    >>> asyncio.run(busy()) == [VALID, BUSY]
+    True
+    """
+
+    def __init__(self, pk_i, sk_i, context, nonce_key=None, nonce_ttl=300, processes=None, queue_size=1024,
+                 authorize=None):
+        self.pk_i = pk_i
+        self.sk_i = sk_i
+        self.context = context
+        self.nonces = StatelessNonces(nonce_key, nonce_ttl)
+        self.queue_size = queue_size
+        self.authorize = authorize
+
+        self.processes = processes
+        self.executor = None
+        self.pending = 0
+        self.server = None
+        self.connections = set()
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Starts the worker pool and the server, returns the bound address"""
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            self.processes, initializer=_init_pool_worker,
+            initargs=(dump_key_bundle(self.pk_i, self.sk_i), int(self.context)))
+        self.server = await asyncio.start_server(self.__handle, host, port)
+
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+        for writer in list(self.connections):
+            writer.close()
+        await asyncio.sleep(0)
+
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def round_0(self):
+        return self.nonces.new()
+
+    async def round_2(self, p1, attr, n1, n2):
+        """
+        Checks the nonce n1 and p1 and signs attr. Returns (status,
+        signature, P2), with signature and P2 None unless status is VALID.
+        """
+        if not self.nonces.check(n1):
+            return INVALID, None, None
+
+        if self.authorize is not None:
+            attr = self.authorize(attr)
+            if attr is None:
+                return INVALID, None, None
+
+        if self.pending >= self.queue_size:
+            return BUSY, None, None
+
+        self.pending += 1
+        try:
+            result = await asyncio.get_event_loop().run_in_executor(
+                self.executor, _pool_issue, _pool_job(p1, attr, n1, n2))
+        finally:
+            self.pending -= 1
+
+        if result is None:
+            return INVALID, None, None
+
+        signature, P2 = _pool_result(result, self.pk_i['N'])
+
+        return VALID, signature, P2
+
+    async def __handle(self, reader, writer):
+        self.connections.add(writer)
+
+        try:
+            while True:
+                (length,) = frame_header.unpack(await reader.readexactly(frame_header.size))
+                if length > max_frame:
+                    break
+
+                reply = await self.__reply(await reader.readexactly(length))
+
+                writer.write(frame_header.pack(len(reply)) + reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def __reply(self, frame):
+        op = frame[:1]
+
+        if op == b'N':
+            return bytes([VALID]) + wire.encode('nonce', self.round_0())
+
+        if op == b'I':
+            try:
+                kind, message = wire.decode(memoryview(frame)[1:], self.pk_i['N'], 'issue')
+                status, signature, P2 = await self.round_2(message['p1'], message['attributes'], message['n1'],
+                                                           message['n2'])
+            except (ValueError, KeyError, TypeError):
+                return bytes([BAD_REQUEST])
+
+            if status != VALID:
+                return bytes([status])
+
+            return bytes([VALID]) + wire.encode('issued', {'signature': signature, 'P2': P2})
+
+        return bytes([BAD_REQUEST])
+
+
+class IssuerClient:
+    'Client of an IssuerService'
+
+    def __init__(self, reader, writer, N):
+        self.reader = reader
+        self.writer = writer
+        self.lock = asyncio.Lock()
+        self.N = N
+
+    async def __request(self, frame):
+        async with self.lock:
+            self.writer.write(frame_header.pack(len(frame)) + frame)
+            await self.writer.drain()
+            (length,) = frame_header.unpack(await self.reader.readexactly(frame_header.size))
+
+            return await self.reader.readexactly(length)
+
+    async def round_0(self):
+        reply = await self.__request(b'N')
+
+        return wire.decode(reply[1:], kind='nonce')[1]
+
+    async def round_2(self, p1, attr, n1, n2):
+        """Returns (status, signature, P2) as IssuerService.round_2"""
+        message = wire.encode('issue', {'p1': p1, 'attributes': attr, 'n1': n1, 'n2': n2})
+        reply = await self.__request(b'I' + message)
+
+        if reply[0] != VALID:
+            return reply[0], None, None
+
+        kind, issued = wire.decode(memoryview(reply)[1:], self.N, 'issued')
+
+        return VALID, issued['signature'], issued['P2']
+
+    def close(self):
+        self.writer.close()
+
+
+async def open_issuer_connection(host, port, pk_i):
+    reader, writer = await asyncio.open_connection(host, port)
+
+    return IssuerClient(reader, writer, pk_i['N'])
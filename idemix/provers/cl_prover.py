@@ -16,38 +16,84 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from charm.core.math.integer import integer, randomBits
-
 from idemix.settings import *
+from idemix.utils import instrument
+from idemix.utils import randomness
+from idemix.utils.arith import integer
+from idemix.utils.fixed_base import generator
+from idemix.utils.multiexp import multiexp
 
 
 class CLProver:
-    def __init__(self):
+    def __init__(self, rng=None):
+        self.rng = randomness.get(rng)
         self.e_tilde = None
         self.e_prime = None
         self.v_prime_tilde = None
         self.v_prime = None
 
-    def prove(self, pk_i, credential, cl_predicate, m, m_tilde, ms=None, c=None):
-        if not c:
-            r_a = integer(randomBits(ln + lo))
-            A_prime = (credential['signature']['A'] * (pk_i['S'] ** r_a)) % pk_i['N']
+    @instrument.step('cl_prover.precompute')
+    def precompute(self, pk_i, credential, m_tilde):
+        """
+        Offline part of the t-value computation, which depends neither on the
+        predicate nor on the verifier's nonce. The returned entry must be used
+        for one proof only.
+        """
+        r_a = integer(self.rng.randomBits(ln + lo))
+        A_prime = multiexp([(credential['signature']['A'], 1), (generator(pk_i, 'S'), r_a)], pk_i['N'])
+        v_prime = credential['signature']['v'] - (credential['signature']['e'] * r_a)
+        e_prime = credential['signature']['e'] - (2 ** (le - 1))
+
+        e_tilde = integer(self.rng.randomBits(lePrime + lo + lh))
+        v_prime_tilde = integer(self.rng.randomBits(lv + lo + lh))
+
+        # A_prime ** e_tilde * S ** v_prime_tilde * Ro ** m_tilde_0, and R_i ** m_tilde_i
+        # separately since the hidden attributes are only known online
+        Z_tilde = multiexp([(A_prime, e_tilde), (generator(pk_i, 'S'), v_prime_tilde),
+                            (generator(pk_i, 'Ro'), m_tilde['0'])], pk_i['N'])
+
+        R_tilde = {}
+        for id in credential['attributes']:
+            R_tilde[id] = multiexp([(generator(pk_i, 'R', id), m_tilde[id])], pk_i['N'])
+
+        return {'A_prime': A_prime, 'v_prime': v_prime, 'e_prime': e_prime, 'e_tilde': e_tilde,
+                'v_prime_tilde': v_prime_tilde, 'm_tilde': m_tilde, 'Z_tilde': Z_tilde, 'R_tilde': R_tilde}
+
+    @instrument.step('cl_prover.prove')
+    def prove(self, pk_i, credential, cl_predicate, m, m_tilde, ms=None, c=None, offline=None):
+        if not c and offline:
+            A_prime = offline['A_prime']
+
+            Z_tilde = offline['Z_tilde']
+            for id in credential['attributes']:
+                if id not in cl_predicate:
+                    Z_tilde = (Z_tilde * offline['R_tilde'][id]) % pk_i['N']
+
+            self.e_tilde = offline['e_tilde']
+            self.e_prime = offline['e_prime']
+            self.v_prime_tilde = offline['v_prime_tilde']
+            self.v_prime = offline['v_prime']
+
+            return Z_tilde, A_prime
+
+        elif not c:
+            r_a = integer(self.rng.randomBits(ln + lo))
+            A_prime = multiexp([(credential['signature']['A'], 1), (generator(pk_i, 'S'), r_a)], pk_i['N'])
             v_prime = credential['signature']['v'] - (credential['signature']['e'] * r_a)
             e_prime = credential['signature']['e'] - (2 ** (le - 1))
 
-            e_tilde = integer(randomBits(lePrime + lo + lh))
-            v_prime_tilde = integer(randomBits(lv + lo + lh))
+            e_tilde = integer(self.rng.randomBits(lePrime + lo + lh))
+            v_prime_tilde = integer(self.rng.randomBits(lv + lo + lh))
 
-            R_tot = 1 % pk_i['N']
+            pairs = []
             for id in credential['attributes']:
                 if id not in cl_predicate:
-                    R_tot = R_tot * (pk_i['R'][id] ** m_tilde[id])
-            R_tot = R_tot * (pk_i['Ro'] ** m_tilde['0'])
-
-            Z_tilde1 = A_prime ** e_tilde
-            Z_tilde3 = pk_i['S'] ** v_prime_tilde
+                    pairs.append((generator(pk_i, 'R', id), m_tilde[id]))
+            pairs.append((generator(pk_i, 'Ro'), m_tilde['0']))
+            pairs.append((A_prime, e_tilde))
+            pairs.append((generator(pk_i, 'S'), v_prime_tilde))
 
-            Z_tilde = (Z_tilde1 * R_tot * Z_tilde3) % pk_i['N']
+            Z_tilde = multiexp(pairs, pk_i['N'])
 
             self.e_tilde = e_tilde
             self.e_prime = e_prime
@@ -67,46 +113,3 @@ class CLProver:
             m_hat['0'] = m_tilde['0'] + (c * ms)
 
             return {'e_hat': e_hat, 'v_prime_hat': v_prime_hat, 'm_hat': m_hat}
-
-
-
-            # def __prove_cg_and(self, predicate, c, m_hat):
-            #     m_hat = m_hat[predicate['index']]  # TODO: ?????
-            #     m = self.m[str(predicate['index'])]  # TODO: ?????
-            #
-            #     mr = reduce(mul, c, 1)
-            #     r = integer(randomBits(ln))
-            #     C = (self.pk_i['Z'] ** m * self.pk_i['S'] ** r) % self.pk_i['N']
-            #
-            #     lmr = mr.bit_length()
-            #     m_h_hat = integer(randomBits(lm + lo + lh + 1 - lmr))
-            #     r_hat = integer(randomBits(ln + lo + lh + 1))
-            #
-            #     C_hat = ((self.pk_i['Z'] ** mr) ** m_h_hat * self.pk_i['S'] ** r_hat) % self.pk_i['N']
-            #     C0_hat = (self.pk_i['Z'] ** m_hat * self.pk_i['S'] ** r_hat) % self.pk_i['N']
-            #
-            #     return {'t-value': {'C_hat': C_hat, 'C0_hat': C0_hat}, 'common-value': C}
-            #
-            # def __prove_cg_not(self, predicate, c, m_hat):
-            #     m = self.m[str(predicate['index'])]  # TODO: ?????
-            #
-            #     mr = reduce(mul, c, 1)
-            #
-            #     r = integer(randomBits(ln))
-            #     C = (self.pk_i['Z'] ** m * self.pk_i['S'] ** r) % self.pk_i['N']
-            #
-            #     r_hat = integer(randomBits(ln + lo + lh + 1))
-            #     m_hat = integer(randomBits(ln + lo + lh + 1))
-            #
-            #     a, b = egcd(m, mr)  # m * a + mr * b = 1
-            #     r_prime = -r * a
-            #
-            #     ni = 1  # TODO:????
-            #     lt = 1  # TODO:????
-            #     r_prime_hat = integer(randomBits(lm + lo + lh + 1 - (ni * lt)))
-            #     a_hat = integer(randomBits(lm + lo + lh + 1 - (ni * lt)))
-            #     b_hat = integer(randomBits(lm + lo + lh + 1 - (ni * lt)))
-            #
-            #     C_hat = (C ** a_hat * (self.pk_i['Z'] ** mr) ** b_hat * self.pk_i['S'] ** r_prime_hat) % self.pk_i['N']
-            #
-            #     return {'t-value': {'C_hat': C_hat}, 'common-value': C}
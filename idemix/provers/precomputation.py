@@ -0,0 +1,150 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import threading
+
+from idemix.provers.cl_prover import CLProver
+from idemix.settings import lm, lo, lh
+from idemix.utils import randomness
+from idemix.utils.arith import integer
+
+
+class PrecomputationPool:
+    """
+    Pool of offline CL prover entries (see CLProver.precompute) for one
+    credential. A background thread keeps depth entries ready; take() hands
+    out each entry once and computes one on the spot when the pool is empty.
+
+    >>> import time
+    >>> from idemix.issuer import Issuer
+    >>> from idemix.recipient import Recipient
+    >>> from idemix.verifier import Verifier
+    >>> issuer = Issuer(3, 0, 0, 255, integer(1), processes=1)
+    >>> (pk_i, sk_i) = issuer.gen_key_pair()
+    >>> user = Recipient(pk_i, integer(1))
+    >>> user.gen_master_secret()
+    >>> attr = user.gen_random_attributes(3)
+    >>> n1 = issuer.round_0()
+    >>> (p1, n2) = user.round_1(n1)
+    >>> (signature, P2) = issuer.round_2(p1['U'], p1, attr, n2)
+    >>> credential = {'attributes': attr, 'signature': user.round_3(signature, P2, n2)[0]}
+    >>> verifier = Verifier(pk_i, integer(1))
+    >>> def ready(pool, count):
+    ...     deadline = time.time() + 30
+    ...     while len(pool.entries) < count and time.time() < deadline:
+    ...         time.sleep(0.01)
+    ...     return len(pool.entries)
+
+    The background thread fills the pool, and refills it after a proof
+    takes an entry:
+
+    >>> pool = user.start_precomputation(credential, depth=2)
+    >>> ready(pool, 2)
+    2
+    >>> nv = verifier.get_nonce()
+    >>> verifier.verifyProof(credential, ['1'], user.build_proof(credential, ['1'], nv), nv)
+    True
+    >>> ready(pool, 2)
+    2
+
+    stop() joins the thread, after which take() computes its entries on the
+    spot:
+
+    >>> thread = pool.thread
+    >>> user.stop_precomputation()
+    >>> (pool.thread, thread.is_alive())
+    (None, False)
+    >>> entries = [pool.take() for k in range(3)]
+    >>> (len(pool.entries), len(entries))
+    (0, 3)
+    >>> user.precomputation = pool
+    >>> nv = verifier.get_nonce()
+    >>> verifier.verifyProof(credential, ['1'], user.build_proof(credential, ['1'], nv), nv)
+    True
+    """
+
+    def __init__(self, pk_i, credential, depth=4, background=True, rng=None):
+        self.pk_i = pk_i
+        self.rng = randomness.get(rng)
+        self.credential = credential
+        self.depth = depth
+
+        self.entries = collections.deque()
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.thread = None
+
+        if background:
+            self.start()
+
+    def compute(self):
+        m_tilde = {}
+        for id in self.credential['attributes']:
+            m_tilde[id] = integer(self.rng.randomBits(lm + lo + lh))
+        m_tilde['0'] = integer(self.rng.randomBits(lm + lo + lh))
+
+        return CLProver(self.rng).precompute(self.pk_i, self.credential, m_tilde)
+
+    def fill(self):
+        while len(self.entries) < self.depth:
+            entry = self.compute()
+            with self.cond:
+                self.entries.append(entry)
+
+    def take(self):
+        with self.cond:
+            entry = self.entries.popleft() if self.entries else None
+            self.cond.notify()
+
+        if entry is None:
+            entry = self.compute()
+
+        return entry
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.stopped = False
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __run(self):
+        while True:
+            with self.cond:
+                while not self.stopped and len(self.entries) >= self.depth:
+                    self.cond.wait()
+
+                if self.stopped:
+                    return
+
+            entry = self.compute()
+
+            with self.cond:
+                self.entries.append(entry)
@@ -0,0 +1,338 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Predicates over hidden attributes
+
+| From: "H. Lipmaa. On Diophantine complexity and statistical
+|         zero-knowledge arguments"
+| Published in: ASIACRYPT 2003
+| Notes: inequality m >= b, m > b, m <= b or m < b, shown by writing the
+|   non-negative difference as a sum of four squares.
+
+| From: "J. Camenisch, T. Gross. Efficient attributes for anonymous
+|         credentials"
+| Published in: CCS 2008
+| Notes: set membership with prime-encoded attributes, the attribute being
+|   the product of the primes of its values: 'and' shows that it is divisible
+|   by every prime of a set, 'not' that it is coprime to all of them.
+
+A predicate is a dict {'type': 'inequality', 'index': id, 'op': op, 'bound': b}
+or {'type': 'and' | 'not', 'index': id, 'primes': [...]}. The attribute must be
+hidden in the CL proof, whose response m_hat[id] links it to the commitments
+of the predicate. Every commitment and t-value is a single multi-exponentiation
+over the fixed-base tables of Z and S.
+
+* type:		zero-knowledge proofs
+* setting:	integer groups
+'''
+
+from idemix.settings import *
+from idemix.utils import randomness
+from idemix.utils.arith import integer, isPrime
+from idemix.utils.fixed_base import generator
+from idemix.utils.multiexp import multiexp
+
+# op -> sign of the attribute in the non-negative difference
+inequality_ops = {'>=': 1, '>': 1, '<=': -1, '<': -1}
+
+
+def inequality_offset(op, bound):
+    """
+    Returns (a, k) such that m op bound holds iff a * m + k >= 0, with a = 1
+    or -1.
+    """
+    if op not in inequality_ops:
+        raise ValueError('unknown inequality %r' % (op,))
+
+    a = inequality_ops[op]
+    k = -a * int(bound) - (1 if op in ('>', '<') else 0)
+
+    return a, k
+
+
+def prime_product(primes):
+    if not primes:
+        raise ValueError('empty set of primes')
+
+    mr = 1
+    for p in primes:
+        mr *= int(p)
+
+    return mr
+
+
+def egcd(a, b):
+    """Returns (x, y) such that a * x + b * y == gcd(a, b)"""
+    x0, x1, y0, y1 = 1, 0, 0, 1
+
+    while b:
+        q = a // b
+        a, b = b, a - q * b
+        x0, x1 = x1, x0 - q * x1
+        y0, y1 = y1, y0 - q * y1
+
+    return x0, y0
+
+
+def isqrt(n):
+    """Largest integer whose square is at most n"""
+    if n < 0:
+        raise ValueError('square root of a negative number')
+    if n == 0:
+        return 0
+
+    x = 1 << ((n.bit_length() + 1) // 2)
+    while True:
+        y = (x + n // x) // 2
+        if y >= x:
+            return x
+        x = y
+
+
+def _two_squares(p, rng):
+    """(x, y) with x ** 2 + y ** 2 == p, for p == 1, 2 or a prime p == 1 mod 4"""
+    if p in (1, 2):
+        return 1, p - 1
+
+    while True:
+        t = pow(2 + int(rng.random(p - 3)), (p - 1) // 4, p)
+        if t * t % p == p - 1:
+            break
+
+    # Hermite-Serret: the first remainders below sqrt(p)
+    a, b = p, t
+    while b * b > p:
+        a, b = b, a % b
+
+    return b, isqrt(p - b * b)
+
+
+def four_squares(n, rng=None):
+    """
+    Returns (u1, u2, u3, u4) with n == u1 ** 2 + u2 ** 2 + u3 ** 2 + u4 ** 2,
+    for n >= 0 (Rabin and Shallit: once the factors 4 are taken out of n,
+    n - x ** 2 - y ** 2 is often a prime congruent to 1 mod 4, which is a sum
+    of two squares).
+
+    >>> [sum(u * u for u in four_squares(n)) == n for n in (0, 1, 7, 96, 1023, 2 ** 256 + 7)]
+    [True, True, True, True, True, True]
+    >>> four_squares(-1)
+    Traceback (most recent call last):
+    ...
+    ValueError: negative number
+    """
+    n = int(n)
+    rng = randomness.get(rng)
+
+    if n < 0:
+        raise ValueError('negative number')
+
+    scale = 1
+    while n and n % 4 == 0:
+        n //= 4
+        scale *= 2
+
+    if n < 1024:
+        for u1 in range(isqrt(n), -1, -1):
+            for u2 in range(min(u1, isqrt(n - u1 * u1)), -1, -1):
+                for u3 in range(min(u2, isqrt(n - u1 * u1 - u2 * u2)), -1, -1):
+                    rest = n - u1 * u1 - u2 * u2 - u3 * u3
+                    u4 = isqrt(rest)
+                    if u4 * u4 == rest:
+                        return tuple(scale * u for u in (u1, u2, u3, u4))
+
+    while True:
+        x = int(rng.random(isqrt(n) + 1))
+        y = int(rng.random(isqrt(n - x * x) + 1))
+        p = n - x * x - y * y
+
+        if p == 0:
+            squares = (x, y, 0, 0)
+        elif p in (1, 2) or (p % 4 == 1 and isPrime(p)):
+            squares = (x, y) + _two_squares(p, rng)
+        else:
+            continue
+
+        return tuple(scale * u for u in squares)
+
+
+def _commit(pk_i, pairs):
+    'Product of base ** exp over pairs, with the generators of pk_i given by name'
+    return multiexp([(generator(pk_i, base), exp) if isinstance(base, str) else (base, exp)
+                     for base, exp in pairs], pk_i['N'])
+
+
+class InequalityProver:
+    """
+    Proves a * m + k = u1^2 + u2^2 + u3^2 + u4^2 >= 0 with the commitments
+    T_i = Z^u_i * S^r_i, T_delta = Z^(a * m + k) * S^r_delta and the relation
+    T_delta = prod(T_i^u_i) * S^alpha.
+    """
+
+    def __init__(self, rng=None):
+        self.rng = randomness.get(rng)
+        self.secrets = None
+        self.tildes = None
+
+    def prove(self, pk_i, predicate, m, m_tilde, c=None):
+        if c:
+            return dict((name, self.tildes[name] + c * self.secrets[name]) for name in self.tildes)
+
+        a, k = inequality_offset(predicate['op'], predicate['bound'])
+        delta = a * m[predicate['index']] + k
+
+        if delta < 0:
+            raise ValueError('predicate does not hold')
+
+        u = four_squares(delta, self.rng)
+
+        secrets = {'r_delta': integer(self.rng.randomBits(ln))}
+        tildes = {'r_delta': integer(self.rng.randomBits(ln + lo + lh)),
+                  'alpha': integer(self.rng.randomBits(ln + lm + lo + lh + 2))}
+        alpha = secrets['r_delta']
+
+        for i in range(1, 5):
+            secrets['u%d' % i] = integer(u[i - 1])
+            secrets['r%d' % i] = integer(self.rng.randomBits(ln))
+            tildes['u%d' % i] = integer(self.rng.randomBits(lm + lo + lh))
+            tildes['r%d' % i] = integer(self.rng.randomBits(ln + lo + lh))
+            alpha -= secrets['u%d' % i] * secrets['r%d' % i]
+
+        secrets['alpha'] = alpha
+
+        common = {'T_delta': _commit(pk_i, [('Z', delta), ('S', secrets['r_delta'])])}
+        t_values = {'T_delta': _commit(pk_i, [('Z', a * m_tilde[predicate['index']]),
+                                              ('S', tildes['r_delta'])])}
+
+        for i in range(1, 5):
+            common['T%d' % i] = _commit(pk_i, [('Z', secrets['u%d' % i]), ('S', secrets['r%d' % i])])
+            t_values['T%d' % i] = _commit(pk_i, [('Z', tildes['u%d' % i]), ('S', tildes['r%d' % i])])
+
+        t_values['Q'] = _commit(pk_i, [(common['T%d' % i], tildes['u%d' % i]) for i in range(1, 5)] +
+                                [('S', tildes['alpha'])])
+
+        self.secrets = secrets
+        self.tildes = tildes
+
+        return t_values, common
+
+
+class SetMembershipProver:
+    """
+    Proves that m, committed as C = Z^m * S^r, is divisible by the product mr
+    of a set of primes ('and': C = (Z^mr)^mh * S^r) or coprime to it ('not':
+    Z = C^a * (Z^mr)^b * S^-ra with a * m + b * mr = 1).
+    """
+
+    def __init__(self, rng=None):
+        self.rng = randomness.get(rng)
+        self.secrets = None
+        self.tildes = None
+
+    def prove(self, pk_i, predicate, m, m_tilde, c=None):
+        if c:
+            return dict((name, self.tildes[name] + c * self.secrets[name]) for name in self.tildes)
+
+        mr = prime_product(predicate['primes'])
+        value = m[predicate['index']]
+
+        secrets = {'r': integer(self.rng.randomBits(ln))}
+        tildes = {'r': integer(self.rng.randomBits(ln + lo + lh))}
+
+        common = {'C': _commit(pk_i, [('Z', value), ('S', secrets['r'])])}
+        t_values = {'C': _commit(pk_i, [('Z', m_tilde[predicate['index']]), ('S', tildes['r'])])}
+
+        if predicate['type'] == 'and':
+            if value % mr:
+                raise ValueError('predicate does not hold')
+
+            secrets['mh'] = integer(value // mr)
+            tildes['mh'] = integer(self.rng.randomBits(lm + lo + lh))
+
+            t_values['C0'] = _commit(pk_i, [('Z', mr * tildes['mh']), ('S', tildes['r'])])
+        else:
+            a, b = egcd(int(value), mr)
+
+            if a * value + b * mr != 1:
+                raise ValueError('predicate does not hold')
+
+            secrets['a'] = integer(a)
+            secrets['b'] = integer(b)
+            secrets['r_prime'] = -secrets['r'] * secrets['a']
+            tildes['a'] = integer(self.rng.randomBits(mr.bit_length() + lo + lh + 1))
+            tildes['b'] = integer(self.rng.randomBits(lm + lo + lh + 1))
+            tildes['r_prime'] = integer(self.rng.randomBits(ln + mr.bit_length() + lo + lh + 1))
+
+            t_values['Z'] = _commit(pk_i, [(common['C'], tildes['a']), ('Z', mr * tildes['b']),
+                                           ('S', tildes['r_prime'])])
+
+        self.secrets = secrets
+        self.tildes = tildes
+
+        return t_values, common
+
+
+provers = {'inequality': InequalityProver, 'and': SetMembershipProver, 'not': SetMembershipProver}
+
+
+def predicate_prover(predicate, rng=None):
+    """
+    Returns the prover of predicate, drawing from rng.
+
+    >>> from idemix.issuer import Issuer
+    >>> from idemix.recipient import Recipient
+    >>> from idemix.verifier import Verifier
+    >>> issuer = Issuer(3, 0, 0, 255, integer(1), processes=1)
+    >>> (pk_i, sk_i) = issuer.gen_key_pair()
+    >>> user = Recipient(pk_i, integer(1))
+    >>> user.gen_master_secret()
+    >>> attr = user.set_attributes({'1': integer(7), '2': integer(40), '3': integer(3 * 7 * 11)})
+    >>> n1 = issuer.round_0()
+    >>> (p1, n2) = user.round_1(n1)
+    >>> (signature, P2) = issuer.round_2(p1['U'], p1, attr, n2)
+    >>> (sig, q2Check, c2Check) = user.round_3(signature, P2, n2)
+    >>> credential = {'attributes': attr, 'signature': sig}
+    >>> disclosed = {'attributes': {'1': attr['1']}}
+    >>> verifier = Verifier(pk_i, integer(1))
+    >>> def check(predicates, asked=None):
+    ...     nv = verifier.get_nonce()
+    ...     proof = user.build_proof(credential, ['1'], nv, predicates)
+    ...     return verifier.verifyProof(disclosed, ['1'], proof, nv, asked or predicates)
+    >>> [check([{'type': 'inequality', 'index': '2', 'op': op, 'bound': bound}])
+    ...  for op, bound in (('>=', 40), ('>', 39), ('<=', 40), ('<', 41))]
+    [True, True, True, True]
+    >>> check([{'type': 'and', 'index': '3', 'primes': [3, 11]}, {'type': 'not', 'index': '3', 'primes': [5, 13]}])
+    True
+
+    An unsatisfied predicate cannot be proven, and a proof does not pass for
+    a stronger predicate than the one it was built for:
+
+    >>> check([{'type': 'inequality', 'index': '2', 'op': '>', 'bound': 40}])
+    Traceback (most recent call last):
+    ...
+    ValueError: predicate does not hold
+    >>> check([{'type': 'inequality', 'index': '2', 'op': '>=', 'bound': 30}],
+    ...       [{'type': 'inequality', 'index': '2', 'op': '>=', 'bound': 31}])
+    False
+    >>> check([{'type': 'and', 'index': '3', 'primes': [3]}], [{'type': 'and', 'index': '3', 'primes': [3, 7]}])
+    False
+    """
+    if predicate.get('type') not in provers:
+        raise ValueError('unknown predicate type %r' % (predicate.get('type'),))
+
+    return provers[predicate['type']](rng)
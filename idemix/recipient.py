@@ -16,90 +16,148 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import hashlib
-
-from charm.core.math.integer import integer, randomBits
-from charm.toolbox.conversion import Conversion
-
 from idemix.provers.cl_prover import CLProver
+from idemix.provers.precomputation import PrecomputationPool
+from idemix.provers.predicate_prover import predicate_prover
 from idemix.settings import *
+from idemix.utils import instrument, randomness
+from idemix.utils.arith import integer
 from idemix.utils.commit_df02 import CM_DF02
-
-
-def egcd(a, b):
-    pass
+from idemix.utils.fixed_base import generator, subkey
+from idemix.utils.multiexp import multiexp
+from idemix.utils.pseudonym import DomainBases
+from idemix.utils.transcript import combined_transcript, issuer_transcript
+from idemix.utils.wallet import key_fingerprint
 
 
 class Recipient:
     'Idemix Recipient'
 
-    def __init__(self, pk_i, context):
+    def __init__(self, pk_i, context, rng=None, wallet=None):
         self.m = {}
         self.v_tilde = {}
         self.t_values = {}
         self.common_value = {}
         self.pk_i = pk_i
         self.context = context
+        self.transcript = issuer_transcript(context, pk_i)
+        self.precomputation = None
+        self.domains = DomainBases(pk_i)
+        self.rng = randomness.get(rng)
+
+        # idemix.utils.wallet.Wallet of the credentials, possibly shared with
+        # the recipients of other issuer keys
+        self.wallet = wallet
+        self.fingerprint = key_fingerprint(pk_i) if wallet is not None else None
 
     def gen_master_secret(self):
-        self.ms = integer(randomBits(lm))
+        self.ms = integer(self.rng.randomBits(lm))
 
     def gen_random_attributes(self, l):
         for i in range(1, l + 1):
-            self.m[str(i)] = integer(randomBits(lm))
+            self.m[str(i)] = integer(self.rng.randomBits(lm))
 
-        Ak = 1 % self.pk_i['N']
         R = self.pk_i['R']
 
-        for i in range(1, len(self.m) + 1):
-            Ak = Ak * (R[str(i)] ** self.m[str(i)])
+        Ak = multiexp([(R[str(i)], self.m[str(i)]) for i in range(1, len(self.m) + 1)], self.pk_i['N'])
 
         Ro = self.pk_i['Ro']
 
-        All = Ak * (Ro ** self.ms)
+        All = Ak * instrument.modexp(Ro, self.ms, self.pk_i['N']) % self.pk_i['N']
 
         self.all = All
         self.ak = Ak
 
         return self.m
 
+    @instrument.step('recipient.set_attributes')
     def set_attributes(self, attr):
-        Ak = 1 % self.pk_i['N']
         R = self.pk_i['R']
 
         self.m = attr
 
-        for i in range(1, len(attr) + 1):
-            Ak = Ak * (R[str(i)] ** self.m[str(i)])
+        Ak = multiexp([(R[str(i)], self.m[str(i)]) for i in range(1, len(attr) + 1)], self.pk_i['N'])
 
         Ro = self.pk_i['Ro']
 
-        All = Ak * (Ro ** self.ms)
+        All = Ak * instrument.modexp(Ro, self.ms, self.pk_i['N']) % self.pk_i['N']
 
         self.all = All
         self.ak = Ak
 
         return self.m
 
-    def round_1(self, n1):
+    @instrument.step('recipient.update_attributes')
+    def update_attributes(self, changes):
+        """
+        Replaces the attributes in changes, a dict id -> value, updating ak
+        and all by R_i ** (new - old) instead of recomputing them. The
+        positive and the negative differences go into two products, so that
+        only one inversion is needed.
+
+        >>> pk = {'N': 1000003 * 1000033, 'S': 4, 'Z': 9, 'Ro': 25, 'R': {'1': 49, '2': 121, '3': 169}}
+        >>> user = Recipient(pk, integer(1))
+        >>> user.gen_master_secret()
+        >>> attr = user.set_attributes({'1': integer(10), '2': integer(20), '3': integer(30)})
+        >>> def fresh(attr):
+        ...     other = Recipient(pk, integer(1))
+        ...     other.ms = user.ms
+        ...     other.set_attributes(attr)
+        ...     return (other.ak, other.all)
+        >>> updated = user.update_attributes({'1': integer(15), '2': integer(5)})
+        >>> ((user.ak, user.all) == fresh({'1': 15, '2': 5, '3': 30}), attr['1'] == 10)
+        (True, True)
+        >>> before = (user.ak, user.all)
+        >>> updated = user.update_attributes({'3': integer(30)})
+        >>> (user.ak, user.all) == before
+        True
+        >>> user.update_attributes({'4': integer(1)})
+        Traceback (most recent call last):
+        ...
+        ValueError: unknown attribute 4
+        """
+        for id in changes:
+            if id not in self.m:
+                raise ValueError('unknown attribute %s' % id)
+
+        N = self.pk_i['N']
+        up = []
+        down = []
+
+        for id, value in changes.items():
+            delta = value - self.m[id]
+            if delta > 0:
+                up.append((generator(self.pk_i, 'R', id), delta))
+            elif delta < 0:
+                down.append((generator(self.pk_i, 'R', id), -delta))
+
+        # set_attributes keeps the caller's dict, which may be that of a credential
+        self.m = dict(self.m)
+        self.m.update(changes)
+
+        if not up and not down:
+            return self.m
+
+        factor = multiexp(up, N)
+        if down:
+            factor = factor * instrument.inverse(multiexp(down, N), N) % N
+
+        self.ak = self.ak * factor % N
+        self.all = self.all * factor % N
 
-        Ro = self.pk_i['Ro']
+        return self.m
+
+    @instrument.step('recipient.round_1')
+    def round_1(self, n1):
 
-        df02_commit = CM_DF02()
-        pk_commit = {'S': self.pk_i['S'], 'Z': Ro, 'N': self.pk_i['N']}
+        df02_commit = CM_DF02(self.rng)
+        pk_commit = subkey(self.pk_i, S='S', Z='Ro')
         (U, self.vPrime) = df02_commit.commit(pk_commit, self.ms, (ln + lo))
 
-        mTilde = integer(randomBits(lm + lo + lh + 1))
+        mTilde = integer(self.rng.randomBits(lm + lo + lh + 1))
         (Utilde, vPrimeTilde) = df02_commit.commit(pk_commit, mTilde, (lm + lo + lh + 1))
 
-        s1 = hashlib.new('sha256')
-
-        s1.update(Conversion.IP2OS(self.context))
-        s1.update(Conversion.IP2OS(U))
-        s1.update(Conversion.IP2OS(Utilde))
-        s1.update(Conversion.IP2OS(n1))
-
-        c = integer(s1.digest())
+        c = self.transcript.copy().append(U, Utilde, n1).challenge()
 
         # Responses to challenge
 
@@ -107,10 +165,11 @@ class Recipient:
         sHat = mTilde + (c * self.ms)
 
         p1 = {'c': c, 'vPrimeHat': vPrimeHat, 'sHat': sHat, 'U': U}
-        n2 = integer(randomBits(lo))
+        n2 = integer(self.rng.randomBits(lo))
 
         return p1, n2
 
+    @instrument.step('recipient.round_3')
     def round_3(self, signature, P2, n2):
 
         vPrimePrime = signature['vPrimePrime']
@@ -123,74 +182,178 @@ class Recipient:
         cPrime = P2['cPrime']
         Se = P2['Se']
 
-        Q2 = (self.pk_i['Z'] / ((self.pk_i['S'] ** v) * self.all)) % self.pk_i['N']
+        Cx = instrument.modexp(self.pk_i['S'], v, self.pk_i['N']) * self.all
+        Q2 = self.pk_i['Z'] * instrument.inverse(Cx, self.pk_i['N']) % self.pk_i['N']
 
         # tmp_u = (self.pk_i['S'] ** self.vPrime) * (self.pk_i['Ro'] ** self.ms) % self.pk_i['N']
 
         # Q22 = (self.pk_i['Z'] / ((self.pk_i['S'] ** vPrimePrime) * self.ak * tmp_u)) % self.pk_i['N']
 
-        Qhat = (A ** e) % self.pk_i['N']
+        Qhat = instrument.modexp(A, e, self.pk_i['N'])
         q2Check = Q2 == Qhat
 
-        Ahat = A ** (cPrime + (Se * e)) % self.pk_i['N']
-
-        s4 = hashlib.new('sha256')
+        Ahat = instrument.modexp(A, cPrime + (Se * e), self.pk_i['N'])
 
-        s4.update(Conversion.IP2OS(self.context))
-        s4.update(Conversion.IP2OS(Q2))
-        s4.update(Conversion.IP2OS(A))
-        s4.update(Conversion.IP2OS(n2))
-        s4.update(Conversion.IP2OS(Ahat))
-
-        cHat2 = integer(s4.digest())
+        cHat2 = self.transcript.copy().append(Q2, A, n2, Ahat).challenge()
         c2Check = cHat2 == cPrime
 
         sig = {'A': A, 'e': e, 'v': v}
 
         return sig, q2Check, c2Check
 
-    def build_proof(self, credentials, predicate, n1):
-        # step 0.1
-        for key, value in self.m.iteritems():
-            self.v_tilde[key] = integer(randomBits(lm + lo + lh))
-            # print self.v_hat
-        self.v_tilde['0'] = integer(randomBits(lm + lo + lh))
-        cl_prover = CLProver()
+    def start_precomputation(self, credential, depth=4, background=True):
+        """
+        Precomputes the nonce-independent part of the proofs for credential,
+        keeping depth entries ready, so that build_proof only hashes and
+        computes the s-values once the verifier's nonce arrives.
+        """
+        self.stop_precomputation()
+        self.precomputation = PrecomputationPool(self.pk_i, credential, depth, background, self.rng)
+
+        return self.precomputation
+
+    def stop_precomputation(self):
+        if self.precomputation is not None:
+            self.precomputation.stop()
+            self.precomputation = None
+
+    def store_credential(self, credential):
+        """Adds credential, issued under pk_i, to the wallet and returns its slot"""
+        return self.wallet.add(self.pk_i, credential, self.fingerprint)
+
+    def find_credential(self, predicate, predicates=None):
+        """
+        Returns a credential of the wallet issued under pk_i that holds the
+        attributes disclosed in predicate and those of predicates, or None.
+        """
+        ids = list(predicate) + [p['index'] for p in predicates or []]
+        slots = self.wallet.find(self.pk_i, ids, self.fingerprint)
+
+        return self.wallet.get(slots[0], self.pk_i['N']) if slots else None
+
+    def pseudonym(self, domain):
+        """Returns the pseudonym of the master secret in domain"""
+        return multiexp([(self.domains.base(domain), self.ms)], self.pk_i['N'])
+
+    @instrument.step('recipient.build_proof')
+    def build_proof(self, credentials, predicate, n1, predicates=None, domain=None):
+        """
+        Proves the possession of credentials disclosing the attributes in
+        predicate and, if given, the predicates over hidden attributes of
+        idemix.provers.predicate_prover, which share the responses m_hat of
+        their attributes with the CL proof. With a domain the proof carries
+        the pseudonym of the master secret in that domain, as common value
+        'nym'.
+        """
+        predicates = predicates or []
+
+        for p in predicates:
+            if p['index'] in predicate:
+                raise ValueError('attribute %s is disclosed' % p['index'])
+
+        offline = None
+
+        if self.precomputation is not None and self.precomputation.credential is credentials:
+            offline = self.precomputation.take()
+            self.v_tilde = dict(offline['m_tilde'])
+        else:
+            # step 0.1
+            for key, value in self.m.items():
+                self.v_tilde[key] = integer(self.rng.randomBits(lm + lo + lh))
+                # print self.v_hat
+            self.v_tilde['0'] = integer(self.rng.randomBits(lm + lo + lh))
+        cl_prover = CLProver(self.rng)
         # print self.all
         # step 1.1: t-values
-        t_value, common_value = cl_prover.prove(self.pk_i, credentials, predicate, self.m, self.v_tilde)
+        t_value, common_value = cl_prover.prove(self.pk_i, credentials, predicate, self.m, self.v_tilde,
+                                                offline=offline)
 
         self.t_values['Z_tilde'] = t_value
         self.common_value['A_prime'] = common_value
+        self.t_values.pop('predicates', None)
+        self.common_value.pop('predicates', None)
+        self.t_values.pop('nym', None)
+        self.common_value.pop('nym', None)
+
+        # step 1.2: t-values of the predicates
+        predicate_provers = []
+        for p in predicates:
+            prover = predicate_prover(p, self.rng)
+            t_value, common_value = prover.prove(self.pk_i, p, self.m, self.v_tilde)
+
+            predicate_provers.append(prover)
+            self.t_values.setdefault('predicates', []).append(t_value)
+            self.common_value.setdefault('predicates', []).append(common_value)
+
+        # step 1.3: pseudonym, proven with the master secret of the CL proof
+        if domain is not None:
+            base = self.domains.base(domain)
+            self.common_value['nym'] = multiexp([(base, self.ms)], self.pk_i['N'])
+            self.t_values['nym'] = multiexp([(base, self.v_tilde['0'])], self.pk_i['N'])
 
         # step 2.1: challenge
-        h_challenge = hashlib.new('sha256')
-        h_challenge.update(Conversion.IP2OS(self.context))
-        h_challenge = self.__add_dict_to_hash(self.common_value, h_challenge)
-        h_challenge = self.__add_dict_to_hash(self.t_values, h_challenge)
-        h_challenge = self.__add_list_to_hash([], h_challenge)  # committed, representation, nym, dnym, verenc, msg
-        h_challenge.update(Conversion.IP2OS(n1))
-        c = integer(h_challenge.digest())
+        c = self.transcript.copy().append(self.common_value, self.t_values, n1).challenge()
 
         # print "t-value:", t_value
 
         # step 3.1: s-values
         s_values = cl_prover.prove(self.pk_i, credentials, predicate, self.m, self.v_tilde, self.ms, c)
 
+        if predicates:
+            s_values['predicates'] = [prover.prove(self.pk_i, p, self.m, self.v_tilde, c)
+                                      for prover, p in zip(predicate_provers, predicates)]
+
         # step 4.1: return proof
         proof = {}
         proof['c'] = c
         proof['s'] = s_values
-        proof['common'] = self.common_value
+        proof['common'] = dict(self.common_value)
+        proof['t-values'] = dict(self.t_values)
         return proof
 
-    def __add_list_to_hash(self, list_obj, hash_obj):
-        for e in list_obj:
-            hash_obj.update(Conversion.IP2OS(e))
-        return hash_obj
+    @instrument.step('recipient.build_combined_proof')
+    def build_combined_proof(self, parts, n1):
+        """
+        Proves the possession of several credentials with a single challenge.
+        parts is a list of (recipient, credential, predicate), the recipient
+        holding the issuer key of the credential; every credential must have
+        been issued on the master secret of self, which gets one response
+        m_hat_0 shared by all the parts.
+        """
+        if not parts:
+            raise ValueError('no credential to prove')
+
+        m_tilde_0 = integer(self.rng.randomBits(lm + lo + lh))
+
+        provers = []
+        commons = []
+        t_values = []
+
+        # step 1.1: t-values
+        for recipient, credential, predicate in parts:
+            m_tilde = dict((id, integer(self.rng.randomBits(lm + lo + lh))) for id in credential['attributes'])
+            m_tilde['0'] = m_tilde_0
+
+            cl_prover = CLProver(self.rng)
+            t_value, common_value = cl_prover.prove(recipient.pk_i, credential, predicate,
+                                                    credential['attributes'], m_tilde)
+
+            provers.append((cl_prover, m_tilde))
+            commons.append({'A_prime': common_value})
+            t_values.append({'Z_tilde': t_value})
+
+        # step 2.1: challenge
+        transcript = combined_transcript([recipient.transcript for recipient, credential, predicate in parts])
+        c = transcript.append(commons, t_values, n1).challenge()
+
+        # step 3.1: s-values
+        proofs = []
+        for (recipient, credential, predicate), (cl_prover, m_tilde), common, t_value in \
+                zip(parts, provers, commons, t_values):
+            s_values = cl_prover.prove(recipient.pk_i, credential, predicate, credential['attributes'], m_tilde,
+                                       self.ms, c)
+            m_hat_0 = s_values['m_hat'].pop('0')
 
-    def __add_dict_to_hash(self, dict_obj, hash_obj):
-        for k, v in dict_obj.iteritems():
-            hash_obj.update(Conversion.IP2OS(v))
+            proofs.append({'s': s_values, 'common': common, 't-values': t_value})
 
-        return hash_obj
+        return {'c': c, 'm_hat_0': m_hat_0, 'proofs': proofs}
@@ -0,0 +1,254 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Big-integer backend
+
+Every module of idemix does its arithmetic on plain integers, reduced
+explicitly modulo N, through the functions of this module:
+
+    integer(x)          conversion from a number or big-endian bytes
+    powmod(b, e, m)     b ** e mod m, e may be negative
+    invert(x, m)        x ** -1 mod m
+    randomBits(n)       uniform in [0, 2 ** n)
+    random(n)           uniform in [0, n)
+    randomPrime(n)      random n-bit prime
+    isPrime(x)          probabilistic primality test
+
+The backend is chosen at startup with the IDEMIX_BACKEND environment
+variable:
+
+    gmpy2   numbers are gmpy2 mpz; falls back to int if gmpy2 is missing
+    int     Python int and the built-in pow
+    charm   Python int, exponentiations and primes from charm.core.math.integer
+
+The default is gmpy2. name holds the backend in use. Randomness always
+comes from os.urandom.
+'''
+
+import binascii
+import os
+import random as _random
+
+_system = _random.SystemRandom()
+
+_small_primes = [p for p in range(3, 1000) if all(p % d for d in range(2, int(p ** 0.5) + 1))]
+
+
+def _from_bytes(data):
+    data = bytes(data)
+
+    return int(binascii.hexlify(data), 16) if data else 0
+
+
+def _random_bits(n):
+    return _system.getrandbits(n) if n > 0 else 0
+
+
+def _random_prime(bits, is_prime, number):
+    while True:
+        x = number(_random_bits(bits) | (1 << (bits - 1)) | 1)
+        if is_prime(x):
+            return x
+
+
+class IntBackend:
+    'Python int and the built-in pow'
+
+    name = 'int'
+
+    def integer(self, x=0):
+        if isinstance(x, (bytes, bytearray, memoryview)):
+            return _from_bytes(x)
+
+        return int(x)
+
+    def powmod(self, b, e, m):
+        if e < 0:
+            b = self.invert(b, m)
+            e = -e
+
+        return pow(b, e, m)
+
+    def invert(self, x, m):
+        r0, r1 = m, x % m
+        s0, s1 = 0, 1
+
+        while r1:
+            q = r0 // r1
+            r0, r1 = r1, r0 - q * r1
+            s0, s1 = s1, s0 - q * s1
+
+        if r0 != 1:
+            raise ZeroDivisionError('not invertible')
+
+        return s0 % m
+
+    def randomBits(self, n):
+        return _random_bits(n)
+
+    def random(self, n):
+        return _system.randrange(int(n))
+
+    def randomPrime(self, bits):
+        return _random_prime(bits, self.isPrime, int)
+
+    def isPrime(self, x, rounds=40):
+        x = int(x)
+
+        if x < 2:
+            return False
+
+        for p in [2] + _small_primes:
+            if x % p == 0:
+                return x == p
+
+        d = x - 1
+        s = 0
+        while not d & 1:
+            d >>= 1
+            s += 1
+
+        for i in range(rounds):
+            y = pow(2 + _system.randrange(x - 3), d, x)
+            if y == 1 or y == x - 1:
+                continue
+            for j in range(s - 1):
+                y = y * y % x
+                if y == x - 1:
+                    break
+            else:
+                return False
+
+        return True
+
+
+class Gmpy2Backend(IntBackend):
+    'gmpy2 mpz'
+
+    name = 'gmpy2'
+
+    def __init__(self):
+        import gmpy2
+
+        self.mpz = gmpy2.mpz
+        self.powmod = gmpy2.powmod
+        self.invert = gmpy2.invert
+        self.is_prime = gmpy2.is_prime
+
+    def integer(self, x=0):
+        if isinstance(x, (bytes, bytearray, memoryview)):
+            return self.mpz(_from_bytes(x))
+
+        return self.mpz(x)
+
+    def randomBits(self, n):
+        return self.mpz(_random_bits(n))
+
+    def random(self, n):
+        return self.mpz(_system.randrange(int(n)))
+
+    def randomPrime(self, bits):
+        return _random_prime(bits, self.isPrime, self.mpz)
+
+    def isPrime(self, x, rounds=40):
+        return self.is_prime(x, rounds)
+
+
+class CharmBackend(IntBackend):
+    'Exponentiations and primes from charm.core.math.integer'
+
+    name = 'charm'
+
+    def __init__(self):
+        from charm.core.math import integer as charm
+
+        self.charm = charm
+
+    def powmod(self, b, e, m):
+        c = self.charm.integer
+
+        return int((c(int(b)) % c(int(m))) ** c(int(e)))
+
+    def invert(self, x, m):
+        c = self.charm.integer
+
+        return int((c(int(x)) % c(int(m))) ** -1)
+
+    def randomPrime(self, bits):
+        return int(self.charm.randomPrime(bits))
+
+    def isPrime(self, x, rounds=40):
+        return bool(self.charm.isPrime(self.charm.integer(int(x))))
+
+
+backends = {'int': IntBackend, 'gmpy2': Gmpy2Backend, 'charm': CharmBackend}
+
+
+def load(name=None):
+    """
+    Returns the backend called name, by default the one in IDEMIX_BACKEND.
+    Every backend that can be loaded gives the same numbers:
+
+    >>> available = []
+    >>> for key in sorted(backends):
+    ...     try:
+    ...         available.append(load(key))
+    ...     except ImportError:
+    ...         pass
+    >>> 'int' in [b.name for b in available]
+    True
+    >>> N = 1000003 * 1000033
+    >>> results = set()
+    >>> for b in available:
+    ...     results.add((int(b.integer(b'\\x01\\x00')), int(b.integer(12)), int(b.powmod(b.integer(7), 12345, N)),
+    ...                  int(b.powmod(7, -5, N)), int(b.invert(7, N)), b.isPrime(1000003), b.isPrime(N)))
+    >>> len(results)
+    1
+    >>> (first,) = results
+    >>> first[:3] == (256, 12, pow(7, 12345, N))
+    True
+    >>> (first[3] * pow(7, 5, N) % N, first[4] * 7 % N, first[5:])
+    (1, 1, (True, False))
+    >>> load('float')
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown arithmetic backend 'float'
+    """
+    name = name or os.environ.get('IDEMIX_BACKEND', 'gmpy2')
+
+    if name not in backends:
+        raise ValueError('unknown arithmetic backend %r' % name)
+
+    try:
+        return backends[name]()
+    except ImportError:
+        if name != 'gmpy2':
+            raise
+        return IntBackend()
+
+
+backend = load()
+
+name = backend.name
+integer = backend.integer
+powmod = backend.powmod
+invert = backend.invert
+randomBits = backend.randomBits
+random = backend.random
+randomPrime = backend.randomPrime
+isPrime = backend.isPrime
@@ -24,6 +24,16 @@ Damgard-Fujisaki-Okamoto Commitment Scheme
 | Notes: The setup functions are based on the Idemix issuing operation. 
 | 	See https://prime.inf.tu-dresden.de/idemix/ (page 15).
 
+| From: "M. Bellare, J. Garay, T. Rabin. Fast batch verification for modular
+|         exponentiation and digital signatures"
+| Published in: EUROCRYPT 1998
+| Notes: decommitBatch and decommitBlockBatch check many openings at once
+| 	with the small exponents test: prod(c_j^r_j) must equal the product of
+| 	the generators raised to the r_j-weighted sums of the openings, for
+| 	random lo-bit r_j. That is a single multi-exponentiation per batch.
+| 	As for any small exponents test, a c_j off by a factor of order 2
+| 	(such as -c_j) only fails the combined check with probability 1/2.
+
 * type:		commitment
 * setting:	integer groups
 
@@ -32,9 +42,14 @@ Damgard-Fujisaki-Okamoto Commitment Scheme
 '''
 
 import hashlib
+import time
 
-from charm.core.math.integer import integer, random, randomBits
-from charm.toolbox.Commit import Commitment
+from idemix.utils import instrument
+from idemix.utils import randomness
+from idemix.utils.arith import integer, random
+from idemix.settings import lo
+from idemix.utils.fixed_base import batch_table, generator
+from idemix.utils.multiexp import multiexp
 
 
 def SHA1(bytes1):
@@ -43,22 +58,21 @@ def SHA1(bytes1):
     return s1.digest()
 
 
-def randomQR(n):
-    return random(n) ** 2
+def randomQR(n, rng=None):
+    return instrument.modexp(randomness.get(rng).random(n), 2, n)
 
 
 debug = False
 
 
-class CM_DF02(Commitment):
+class CM_DF02:
     """
-    >>> from charm.toolbox.conversion import Conversion
     >>> commitment = CM_DF02()
     >>> p = integer(333437049425486136095925931727629203622119239282802038455917646172563395024265917241890473852501318262109839243221497854682815506880304349748481648877420618747530394310060738051284980323398797638078562462943477904211178707988798971266777314022673227003284335883622084916018185539789562312940907090712386355299)
     >>> q = integer(294092988306368388636535355362351220952777074915662080329740789451817968606482246364359892865057621298389179478994706465098262699509935804409002480293234947971872131356003427444279672200378079370695651721652248116723483318427208508192689675310517884904089979454005634358395042846262967137935407297336359215239)
     >>> N = p*q
     >>> pk = commitment.setup(N=N)
-    >>> msg = integer(SHA1(Conversion.IP2OS(random(pk['N']))))
+    >>> msg = integer(SHA1(str(random(pk['N'])).encode()))
     >>> lr = 2048 + 80
     >>> (c, d) = commitment.commit(pk, msg, lr)
     >>> commitment.decommit(pk, c, d, msg)
@@ -66,21 +80,27 @@ class CM_DF02(Commitment):
     >>> pk = commitment.setupBlock(N=N, l=16)
     >>> msg = {}
     >>> l = 16
-    >>> for i in range(1, l + 1): msg[str(i)] = integer(SHA1(Conversion.IP2OS(random(pk['N']))))
+    >>> for i in range(1, l + 1): msg[str(i)] = integer(SHA1(str(random(pk['N'])).encode()))
     >>> lr = 2048 + 80
     >>> (c, d) = commitment.commitBlock(pk, msg, lr)
     >>> commitment.decommitBlock(pk, c, d, msg)
     True
+    >>> msgs = [dict((str(i), integer(i * j)) for i in range(1, l + 1)) for j in range(8)]
+    >>> openings = commitment.commitBlockBatch(pk, msgs, lr)
+    >>> commitment.decommitBlockBatch(pk, [(c, d, m) for (c, d), m in zip(openings, msgs)])
+    [True, True, True, True, True, True, True, True]
+    >>> commitment.decommitBlockBatch(pk, [(c, d + 1, m) for (c, d), m in zip(openings, msgs)][:2])
+    [False, False]
     """
 
-    def __init__(self):
-        Commitment.__init__(self)
+    def __init__(self, rng=None):
+        self.rng = randomness.get(rng)
 
     def setup(self, secparam=None, N=0):
-        Xz = integer(random(N))
+        Xz = integer(self.rng.random(N))
 
-        S = randomQR(N)
-        Z = S ** Xz
+        S = randomQR(N, self.rng)
+        Z = instrument.modexp(S, Xz, N)
 
         return {'S': S, 'Z': Z, 'N': N}
 
@@ -88,66 +108,163 @@ class CM_DF02(Commitment):
         Xr = {}
 
         for i in range(1, l + 1):
-            Xr[str(i)] = integer(random(N))
+            Xr[str(i)] = integer(self.rng.random(N))
 
-        S = randomQR(N)
+        S = randomQR(N, self.rng)
         R = {}
 
         for i in range(1, l + 1):
-            R[str(i)] = S ** Xr[str(i)]
+            R[str(i)] = instrument.modexp(S, Xr[str(i)], N)
 
         return {'S': S, 'R': R, 'N': N}
 
+    @instrument.step('df02.commit')
     def commit(self, pk, msg, lr, ri=0):
-        S = pk['S']
-        Z = pk['Z']
+        S = generator(pk, 'S')
+        Z = generator(pk, 'Z')
 
         if (lr == 0):
             r = ri
         else:
-            r = integer(randomBits(lr))
+            r = integer(self.rng.randomBits(lr))
 
-        c = ((Z ** msg) * (S ** r)) % pk['N']
+        c = multiexp([(Z, msg), (S, r)], pk['N'])
         d = r
 
         return (c, d)
 
+    @instrument.step('df02.commitBlock')
     def commitBlock(self, pk, msg, lr, ri=0):
-        Cx = 1 % pk['N']
-
         R = pk['R']
         S = pk['S']
 
         if (lr == 0):
             r = ri
         else:
-            r = integer(randomBits(lr))
+            r = integer(self.rng.randomBits(lr))
 
-        for i in range(1, len(msg) + 1):
-            Cx = Cx * (R[str(i)] ** msg[str(i)])
+        pairs = [(R[str(i)], msg[str(i)]) for i in range(1, len(msg) + 1)]
+        pairs.append((S, r))
 
-        c = (Cx * (S ** r)) % pk['N']
+        c = multiexp(pairs, pk['N'])
         d = r
 
         return (c, d)
 
+    @instrument.step('df02.decommit')
     def decommit(self, pk, c, d, msg):
-        S = pk['S']
-        Z = pk['Z']
+        S = generator(pk, 'S')
+        Z = generator(pk, 'Z')
 
-        cP = ((Z ** msg) * (S ** d)) % pk['N']
+        cP = multiexp([(Z, msg), (S, d)], pk['N'])
 
         return c == cP
 
+    @instrument.step('df02.decommitBlock')
     def decommitBlock(self, pk, c, d, msg):
-        Cx = 1 % pk['N']
-
         R = pk['R']
         S = pk['S']
 
-        for i in range(1, len(msg) + 1):
-            Cx = Cx * (R[str(i)] ** msg[str(i)])
+        pairs = [(R[str(i)], msg[str(i)]) for i in range(1, len(msg) + 1)]
+        pairs.append((S, d))
 
-        cP = (Cx * (S ** d)) % pk['N']
+        cP = multiexp(pairs, pk['N'])
 
         return c == cP
+
+    def __randomness(self, count, lr, ri):
+        if lr == 0:
+            return list(ri)
+
+        return [integer(self.rng.randomBits(lr)) for k in range(count)]
+
+    @instrument.step('df02.commitBatch')
+    def commitBatch(self, pk, msgs, lr, ri=None):
+        """
+        Returns the (c, d) of commit for every message of msgs. The squarings
+        of Z and S are done once for the batch, in fixed-base tables, so that
+        every commitment only takes multiplications. With lr == 0 ri is the
+        list of randomness to use.
+        """
+        r = self.__randomness(len(msgs), lr, ri)
+        bits = max([int(m).bit_length() for m in msgs] + [0])
+
+        Z = batch_table(generator(pk, 'Z'), pk['N'], bits, len(msgs))
+        S = batch_table(generator(pk, 'S'), pk['N'], max([int(x).bit_length() for x in r] + [0]), len(msgs))
+
+        return [(multiexp([(Z, m), (S, x)], pk['N']), x) for m, x in zip(msgs, r)]
+
+    @instrument.step('df02.commitBlockBatch')
+    def commitBlockBatch(self, pk, msgs, lr, ri=None):
+        """
+        Returns the (c, d) of commitBlock for every message vector of msgs,
+        with a fixed-base table per generator shared by the batch.
+        """
+        r = self.__randomness(len(msgs), lr, ri)
+        N = pk['N']
+
+        ids = set(id for msg in msgs for id in msg)
+        bits = dict((id, max(int(msg[id]).bit_length() for msg in msgs if id in msg)) for id in ids)
+
+        R = dict((id, batch_table(generator(pk, 'R', id), N, bits[id], len(msgs))) for id in ids)
+        S = batch_table(generator(pk, 'S'), N, max([int(x).bit_length() for x in r] + [0]), len(msgs))
+
+        openings = []
+        for msg, x in zip(msgs, r):
+            pairs = [(R[str(i)], msg[str(i)]) for i in range(1, len(msg) + 1)]
+            pairs.append((S, x))
+            openings.append((multiexp(pairs, N), x))
+
+        return openings
+
+    @instrument.step('df02.decommitBatch')
+    def decommitBatch(self, pk, openings):
+        """
+        Checks a list of (c, d, msg) openings of commit, returning a list of
+        booleans. If the combined check fails every opening is checked with
+        decommit, so that the result pins down the bad ones.
+        """
+        return self.__batch(pk, openings, self.decommit, lambda msg: [(('Z',), msg)])
+
+    @instrument.step('df02.decommitBlockBatch')
+    def decommitBlockBatch(self, pk, openings):
+        """
+        Checks a list of (c, d, msg) openings of commitBlock like
+        decommitBatch, with one multi-exponentiation for the whole batch
+        instead of one R_i ** m_i product per opening.
+        """
+        return self.__batch(pk, openings, self.decommitBlock,
+                            lambda msg: [(('R', str(i)), msg[str(i)]) for i in range(1, len(msg) + 1)])
+
+    def __batch(self, pk, openings, decommit, terms):
+        start = time.time()
+        N = pk['N']
+        fallback = False
+
+        if len(openings) < 2:
+            results = [decommit(pk, c, d, msg) for c, d, msg in openings]
+        else:
+            # prod(c_j ** r_j) * prod(g ** -(sum of r_j * exp)) == 1, the
+            # generators g given by their (name,) or (name, id)
+            pairs = []
+            exps = {}
+
+            for c, d, msg in openings:
+                r = integer(self.rng.randomBits(lo))
+                pairs.append((c % N, r))
+
+                for key, exp in terms(msg) + [(('S',), d)]:
+                    exps[key] = exps.get(key, 0) - r * exp
+
+            pairs += [(generator(pk, *key), exp) for key, exp in exps.items()]
+
+            if multiexp(pairs, N) == 1 % N:
+                results = [True] * len(openings)
+            else:
+                fallback = True
+                results = [decommit(pk, c, d, msg) for c, d, msg in openings]
+
+        seconds = time.time() - start
+        self.batch_stats = {'openings': len(openings), 'seconds': seconds, 'fallback': fallback}
+
+        return results
@@ -0,0 +1,188 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Fixed-base exponentiation with precomputed window tables
+
+| From: "E. Brickell, D. Gordon, K. McCurley, D. Wilson. Fast exponentiation
+|         with precomputation"
+| Published in: EUROCRYPT 1992
+| Notes: For a window w the table stores base ** (d * 2 ** (j * w)) for every
+|   digit d < 2 ** w and every window position j, so an exponentiation is
+|   bits / w multiplications and no squarings. The table holds
+|   (2 ** w - 1) * bits / w group elements.
+
+* type:		arithmetic
+* setting:	integer groups
+'''
+
+from idemix.settings import lh, lm, lo, lv
+from idemix.utils import instrument
+
+# Default window and exponent size for every generator of an issuer key.
+# 'R' applies to every R_i, unless an entry 'R<i>' is given.
+default_windows = {'S': 4, 'Z': 4, 'Ro': 4, 'R': 4}
+default_bits = {'S': lv + lo + lh + 1, 'Z': lh, 'Ro': lm + lo + lh + 1, 'R': lm + lo + lh + 1}
+
+
+class FixedBaseTable:
+    """
+    Fixed-base window table. pow() also takes negative exponents and
+    exponents wider than `bits`, at the cost of an inversion or of a plain
+    exponentiation of the part above the table.
+
+    >>> from idemix.utils.arith import invert
+    >>> N = 1000003 * 1000033
+    >>> table = FixedBaseTable(7, N, 32, window=3)
+    >>> [table.pow(e) == pow(7, e, N) for e in (0, 1, 2 ** 32 - 1, 2 ** 32, 3 ** 50)]
+    [True, True, True, True, True]
+    >>> table.pow(-12345) == pow(invert(7, N), 12345, N)
+    True
+    >>> table.pow(-(3 ** 50)) * pow(7, 3 ** 50, N) % N == 1
+    True
+    """
+
+    def __init__(self, base, N, bits, window=4):
+        self.N = N
+        self.bits = bits
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.rows = []
+
+        g = base % N
+        for j in range((bits + window - 1) // window):
+            row = [g]
+            for d in range(2, 1 << window):
+                row.append((row[-1] * g) % N)
+            self.rows.append(row)
+            g = (row[-1] * g) % N
+
+        # base ** (2 ** (len(rows) * window)), used for oversized exponents
+        self.top = g
+
+    def pow(self, exp):
+        e = int(exp)
+
+        if e < 0:
+            return instrument.inverse(self.pow(-e), self.N)
+
+        if instrument.collector is not None:
+            instrument.record('fixed_base', self.rows[0][0], e)
+
+        acc = None
+
+        for row in self.rows:
+            if not e:
+                break
+
+            d = e & self.mask
+            if d:
+                acc = row[d - 1] if acc is None else (acc * row[d - 1]) % self.N
+            e >>= self.window
+
+        if e:
+            high = instrument.modexp(self.top, e, self.N)
+            acc = high if acc is None else (acc * high) % self.N
+
+        if acc is None:
+            return 1 % self.N
+
+        return acc
+
+
+class PrecomputedPublicKey(dict):
+    """
+    Issuer public key carrying fixed-base tables for its generators.
+
+    It can be used wherever the plain pk_i dict is expected. windows and bits
+    override default_windows and default_bits per generator name ('S', 'Z',
+    'Ro', 'R' or 'R<i>'); a window of 0 leaves that generator without a table.
+    """
+
+    def __init__(self, pk, windows=None, bits=None):
+        dict.__init__(self, pk)
+        self.tables = {}
+
+        if windows is None:
+            windows = {}
+        if bits is None:
+            bits = {}
+
+        names = [name for name in ('S', 'Z', 'Ro') if name in pk]
+        names += ['R' + id for id in pk.get('R', {})]
+
+        for name in names:
+            group = 'R' if name not in default_windows else name
+            w = windows.get(name, windows.get(group, default_windows[group]))
+
+            if not w:
+                continue
+
+            b = bits.get(name, bits.get(group, default_bits[group]))
+            base = pk['R'][name[1:]] if group != name else pk[name]
+
+            self.tables[name] = FixedBaseTable(base, pk['N'], b, w)
+
+
+def batch_table(base, N, bits, count, max_window=6):
+    """
+    Returns a table for count exponentiations of base with exponents of at
+    most bits bits, or base itself if it already is a table or if a table
+    would cost more than count separate exponentiations. The window minimizes
+    the (2 ** w - 1 + count) * bits / w multiplications of the table and the
+    exponentiations.
+    """
+    if isinstance(base, FixedBaseTable) or count < 4 or bits <= 0:
+        return base
+
+    window = min(range(1, max_window + 1), key=lambda w: ((1 << w) - 1 + count) / float(w))
+
+    return FixedBaseTable(base, N, bits, window)
+
+
+def generator(pk, name, id=None):
+    """Returns the fixed-base table of a generator of pk if it has one, the generator otherwise"""
+    key = name if id is None else name + id
+    tables = getattr(pk, 'tables', {})
+
+    if key in tables:
+        return tables[key]
+
+    return pk[name] if id is None else pk[name][id]
+
+
+def subkey(pk, **names):
+    """
+    Returns {'N': pk['N'], alias: pk[name], ...}, sharing the fixed-base
+    tables of pk. For instance subkey(pk_i, S='S', Z='Ro') is the DF02
+    commitment key used for the master secret.
+    """
+    key = {'N': pk['N']}
+
+    for alias, name in names.items():
+        key[alias] = pk[name]
+
+    if not isinstance(pk, PrecomputedPublicKey):
+        return key
+
+    sub = PrecomputedPublicKey(key, windows={'S': 0, 'Z': 0, 'Ro': 0})
+
+    for alias, name in names.items():
+        if name in pk.tables:
+            sub.tables[alias] = pk.tables[name]
+
+    return sub
@@ -0,0 +1,257 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Optional instrumentation of the protocol hot paths
+
+Protocol steps are wrapped with @step(name) and the modular arithmetic goes
+through modexp(), inverse() or record(). Nothing is measured until a
+collector is installed with set_collector():
+
+    collector = MemoryCollector()
+    set_collector(collector)
+    ...
+    set_collector(None)
+
+A collector receives operation(step, kind, base_bits, exp_bits) for every
+operation, attributed to the innermost step running in the calling thread,
+and step(name, seconds) when a step returns. kind is one of 'modexp',
+'inverse', 'multiexp' (one per base of a multi-exponentiation) and
+'fixed_base'. With no collector every hook is a single global lookup.
+'''
+
+import functools
+import logging
+import threading
+import time
+
+from idemix.utils.arith import invert, powmod
+
+collector = None
+
+_local = threading.local()
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def set_collector(new):
+    """Installs a collector, or None to turn instrumentation off. Returns the previous one."""
+    global collector
+
+    old = collector
+    collector = new
+
+    return old
+
+
+def _bits(x):
+    return abs(int(x)).bit_length()
+
+
+def record(kind, base, exp=None):
+    """Reports an operation on base with exponent exp to the collector, if any"""
+    if collector is None:
+        return
+
+    stack = getattr(_local, 'stack', None)
+
+    collector.operation(stack[-1] if stack else None, kind, _bits(base), 0 if exp is None else _bits(exp))
+
+
+def modexp(base, exp, N):
+    if collector is not None:
+        record('modexp', base, exp)
+
+    return powmod(base, exp, N)
+
+
+def inverse(x, N):
+    if collector is not None:
+        record('inverse', x)
+
+    return invert(x, N)
+
+
+def step(name):
+    """Decorator timing a protocol step and attributing its operations to name"""
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            c = collector
+            if c is None:
+                return fn(*args, **kwargs)
+
+            stack = getattr(_local, 'stack', None)
+            if stack is None:
+                stack = _local.stack = []
+
+            stack.append(name)
+            start = timer()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                c.step(name, timer() - start)
+                stack.pop()
+
+        return wrapper
+
+    return decorate
+
+
+class MemoryCollector:
+    """
+    Keeps totals in memory: operations[(step, kind)] = [count, sum of
+    exponent bits, sum of base bits, largest exponent bits] and
+    steps[name] = [calls, total seconds, slowest call].
+
+    >>> @step('demo.outer')
+    ... def outer(x, N):
+    ...     return inner(x, N) * inverse(x, N) % N
+    >>> @step('demo.inner')
+    ... def inner(x, N):
+    ...     return modexp(x, 255, N)
+    >>> collector = MemoryCollector()
+    >>> previous = set_collector(collector)
+    >>> outer(3, 101) == pow(3, 254, 101)
+    True
+    >>> record('multiexp', 5, 1000)
+    >>> previous = set_collector(previous)
+    >>> (collector.operations[('demo.inner', 'modexp')], collector.operations[('demo.outer', 'inverse')])
+    ([1, 8, 2, 8], [1, 0, 2, 0])
+    >>> collector.counts() == {'demo.inner': 1, 'demo.outer': 1, None: 1}
+    True
+    >>> collector.counts('multiexp')
+    {None: 1}
+    >>> [(name, collector.steps[name][0], 0 <= collector.steps[name][2] <= collector.steps[name][1])
+    ...  for name in sorted(collector.steps)]
+    [('demo.inner', 1, True), ('demo.outer', 1, True)]
+
+    Without a collector nothing is recorded:
+
+    >>> outer(3, 101) == pow(3, 254, 101)
+    True
+    >>> collector.steps['demo.outer'][0]
+    1
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+            self.steps = {}
+
+    def operation(self, step, kind, base_bits, exp_bits):
+        with self.lock:
+            entry = self.operations.get((step, kind))
+            if entry is None:
+                entry = self.operations[(step, kind)] = [0, 0, 0, 0]
+            entry[0] += 1
+            entry[1] += exp_bits
+            entry[2] += base_bits
+            entry[3] = max(entry[3], exp_bits)
+
+    def step(self, name, seconds):
+        with self.lock:
+            entry = self.steps.get(name)
+            if entry is None:
+                entry = self.steps[name] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def counts(self, kind=None):
+        """Returns {step: number of operations}, of one kind or of every kind"""
+        counts = {}
+        with self.lock:
+            for (step, k), entry in self.operations.items():
+                if kind is None or k == kind:
+                    counts[step] = counts.get(step, 0) + entry[0]
+
+        return counts
+
+
+class LoggingCollector:
+    'Logs every step, and every operation if operations is True'
+
+    def __init__(self, logger=None, level=logging.DEBUG, operations=False):
+        self.logger = logger or logging.getLogger('idemix.instrument')
+        self.level = level
+        self.operations = operations
+
+    def operation(self, step, kind, base_bits, exp_bits):
+        if self.operations:
+            self.logger.log(self.level, '%s: %s base %d bits, exponent %d bits', step, kind, base_bits, exp_bits)
+
+    def step(self, name, seconds):
+        self.logger.log(self.level, '%s: %.3f ms', name, seconds * 1000)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+class PrometheusCollector(MemoryCollector):
+    """
+    MemoryCollector whose totals render() as Prometheus text exposition format
+
+    >>> collector = PrometheusCollector()
+    >>> collector.operation('issuer.round_2', 'modexp', 1024, 597)
+    >>> collector.step('issuer.round_2', 0.25)
+    >>> lines = collector.render().splitlines()
+    >>> 'idemix_exponent_bits_total{step="issuer.round_2",kind="modexp"} 597' in lines
+    True
+    >>> 'idemix_step_seconds_total{step="issuer.round_2"} 0.250000000' in lines
+    True
+    """
+
+    def __init__(self, prefix='idemix'):
+        self.prefix = prefix
+        MemoryCollector.__init__(self)
+
+    def render(self):
+        p = self.prefix
+        lines = []
+
+        with self.lock:
+            operations = sorted(self.operations.items(), key=lambda item: (str(item[0][0]), item[0][1]))
+            steps = sorted(self.steps.items())
+
+        metrics = [('operations_total', 0, 'Modular operations'),
+                   ('exponent_bits_total', 1, 'Sum of the exponent bit lengths'),
+                   ('base_bits_total', 2, 'Sum of the base bit lengths')]
+
+        for name, index, help in metrics:
+            lines.append('# HELP %s_%s %s' % (p, name, help))
+            lines.append('# TYPE %s_%s counter' % (p, name))
+            for (step, kind), entry in operations:
+                lines.append('%s_%s{step="%s",kind="%s"} %d' % (p, name, _label(step or ''), _label(kind),
+                                                               entry[index]))
+
+        metrics = [('step_calls_total', 0, 'Protocol step calls', '%d'),
+                   ('step_seconds_total', 1, 'Wall time spent in protocol steps', '%.9f')]
+
+        for name, index, help, fmt in metrics:
+            lines.append('# HELP %s_%s %s' % (p, name, help))
+            lines.append('# TYPE %s_%s counter' % (p, name))
+            for step, entry in steps:
+                lines.append(('%s_%s{step="%s"} ' + fmt) % (p, name, _label(step), entry[index]))
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,177 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Binary issuer key bundle
+
+Layout, big-endian:
+
+    header   magic 'IDMXKEY', version (1 byte), flags (1 byte), reserved
+             (1 byte), l (2 bytes), W (4 bytes)
+    fields   W bytes each: N, S, Z, Ro, R_1 ... R_l
+             then p, q                   if flags & HAS_SECRET
+             then phi(N), q^-1 mod p     if flags & HAS_CRT
+
+W is the byte length of N, so the offset of every field is known from the
+header alone and a bundle can be decoded straight from a mmap.
+'''
+
+import binascii
+import mmap
+import struct
+
+from idemix.utils.arith import integer
+
+MAGIC = b'IDMXKEY'
+VERSION = 1
+
+HAS_SECRET = 1
+HAS_CRT = 2
+
+header = struct.Struct('>7sBBBHI')
+
+
+def _check_flags(flags):
+    # the CRT fields are read after p and q, so they need the secret key
+    if flags & ~(HAS_SECRET | HAS_CRT) or (flags & HAS_CRT and not flags & HAS_SECRET):
+        raise ValueError('invalid issuer key bundle flags')
+
+
+def _encode(value, width):
+    return binascii.unhexlify('%0*x' % (2 * width, int(value)))
+
+
+def _decode(data, offset, width):
+    return integer(int(binascii.hexlify(data[offset:offset + width]), 16))
+
+
+def dump_key_bundle(pk, sk=None):
+    """
+    Encodes an issuer public key, and optionally its secret key, as a
+    bundle. The CRT values are included when sk was precomputed by
+    Sig_CL03_Idmx.precompute.
+    """
+    width = (int(pk['N']).bit_length() + 7) // 8
+    l = len(pk['R'])
+
+    fields = [pk['N'], pk['S'], pk['Z'], pk['Ro']]
+    fields += [pk['R'][str(i)] for i in range(1, l + 1)]
+
+    flags = 0
+    if sk is not None:
+        flags |= HAS_SECRET
+        fields += [sk['p'], sk['q']]
+
+        if 'qInv' in sk:
+            flags |= HAS_CRT
+            fields += [sk['phi_N'], sk['qInv']]
+
+    _check_flags(flags)
+
+    data = [header.pack(MAGIC, VERSION, flags, 0, l, width)]
+    data += [_encode(value, width) for value in fields]
+
+    return b''.join(data)
+
+
+def load_key_bundle(data):
+    """
+    Decodes a bundle from any buffer (bytes, memoryview, mmap) and returns
+    (pk, sk), with sk None if the bundle has no secret key.
+
+    >>> from idemix.utils.arith import integer
+    >>> p, q = integer(1019), integer(1187)
+    >>> pk = {'N': p * q, 'S': 4, 'Z': 9, 'Ro': 16, 'R': {'1': 25, '2': 36}}
+    >>> sk = {'p': p, 'q': q, 'phi_N': (p - 1) * (q - 1), 'qInv': pow(int(q), int(p) - 2, int(p))}
+    >>> (pk2, sk2) = load_key_bundle(dump_key_bundle(pk, sk))
+    >>> pk2 == pk and (sk2['p'], sk2['q'], sk2['qInv']) == (p, q, sk['qInv'])
+    True
+    >>> load_key_bundle(dump_key_bundle(pk)) == (pk, None)
+    True
+    >>> data = dump_key_bundle(pk, sk)
+    >>> for bad in (data[:-1], data + b'\\x00', b'IDMXKEZ' + data[7:],
+    ...             data[:8] + b'\\x02' + data[9:], data[:8] + b'\\x07' + data[9:]):
+    ...     try:
+    ...         load_key_bundle(bad)
+    ...     except ValueError as e:
+    ...         print(e)
+    truncated issuer key bundle
+    truncated issuer key bundle
+    not an issuer key bundle, or unsupported version
+    invalid issuer key bundle flags
+    invalid issuer key bundle flags
+    """
+    if len(data) < header.size:
+        raise ValueError('truncated issuer key bundle')
+
+    (magic, version, flags, reserved, l, width) = header.unpack_from(data)
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not an issuer key bundle, or unsupported version')
+
+    _check_flags(flags)
+
+    count = 4 + l
+    if flags & HAS_SECRET:
+        count += 2
+    if flags & HAS_CRT:
+        count += 2
+
+    if len(data) != header.size + count * width:
+        raise ValueError('truncated issuer key bundle')
+
+    offsets = range(header.size, header.size + count * width, width)
+
+    N = _decode(data, offsets[0], width)
+    pk = {'N': N,
+          'S': _decode(data, offsets[1], width) % N,
+          'Z': _decode(data, offsets[2], width) % N,
+          'Ro': _decode(data, offsets[3], width) % N,
+          'R': {}}
+
+    for i in range(1, l + 1):
+        pk['R'][str(i)] = _decode(data, offsets[3 + i], width) % N
+
+    if not flags & HAS_SECRET:
+        return pk, None
+
+    p = _decode(data, offsets[4 + l], width)
+    q = _decode(data, offsets[5 + l], width)
+    sk = {'p': p, 'q': q}
+
+    if flags & HAS_CRT:
+        sk['p-1'] = p - 1
+        sk['q-1'] = q - 1
+        sk['phi_N'] = _decode(data, offsets[6 + l], width)
+        sk['qInv'] = _decode(data, offsets[7 + l], width) % p
+
+    return pk, sk
+
+
+def write_key_bundle(path, pk, sk=None):
+    with open(path, 'wb') as f:
+        f.write(dump_key_bundle(pk, sk))
+
+
+def read_key_bundle(path):
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        return load_key_bundle(data)
+    finally:
+        data.close()
@@ -0,0 +1,154 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Simultaneous multi-exponentiation (interleaved sliding window)
+
+| From: "B. Moeller. Algorithms for multi-exponentiation"
+| Published in: SAC 2001
+| Notes: Straus' trick with one sliding-window table per base. All the
+|   exponentiations of a product share a single squaring chain, so a product
+|   of k powers costs roughly one exponentiation plus k * bits / (w + 1)
+|   multiplications instead of k full exponentiations.
+
+* type:		arithmetic
+* setting:	integer groups
+'''
+
+from idemix.utils import instrument
+from idemix.utils.fixed_base import FixedBaseTable
+
+
+def window_size(bits):
+    # Same thresholds used by OpenSSL for single exponentiations
+    if bits > 671:
+        return 6
+    if bits > 239:
+        return 5
+    if bits > 79:
+        return 4
+    if bits > 23:
+        return 3
+    return 1
+
+
+def recode(e, w):
+    """
+    Sliding-window recoding of a non-negative exponent.
+
+    Returns a list of (position, digit) pairs, from the most significant one,
+    where every digit is odd and smaller than 2 ** w and
+    e == sum(digit << position).
+    """
+    digits = []
+    i = e.bit_length() - 1
+
+    while i >= 0:
+        if not (e >> i) & 1:
+            i -= 1
+            continue
+
+        j = max(i - w + 1, 0)
+        while not (e >> j) & 1:
+            j += 1
+
+        digits.append((j, (e >> j) & ((1 << (i - j + 1)) - 1)))
+        i = j - 1
+
+    return digits
+
+
+def odd_powers(base, w, N):
+    """Returns [base, base ** 3, ..., base ** (2 ** w - 1)] modulo N"""
+    table = [base]
+
+    if w > 1:
+        base2 = (base * base) % N
+        for k in range(1, 1 << (w - 1)):
+            table.append((table[k - 1] * base2) % N)
+
+    return table
+
+
+def multiexp(pairs, N, window=None):
+    """
+    Computes the product of base ** exp modulo N for every (base, exp) in pairs.
+
+    Negative exponents are handled by inverting their base once. If window is
+    None the window size is chosen independently for every exponent. Bases
+    given as a FixedBaseTable are evaluated from their table and do not take
+    part in the squaring chain.
+
+    >>> from idemix.utils.arith import invert
+    >>> N = 1000003 * 1000033
+    >>> multiexp([(5, 12345), (7, -678), (11, 0)], N) == pow(5, 12345, N) * pow(invert(7, N), 678, N) % N
+    True
+    >>> table = FixedBaseTable(3, N, 16)
+    >>> multiexp([(table, 2 ** 40 + 9), (5, 2 ** 100)], N) == pow(3, 2 ** 40 + 9, N) * pow(5, 2 ** 100, N) % N
+    True
+    >>> multiexp([], N)
+    1
+    """
+    schedule = {}
+    fixed = []
+    top = -1
+
+    for base, exp in pairs:
+        if isinstance(base, FixedBaseTable):
+            fixed.append(base.pow(exp))
+            continue
+
+        e = int(exp)
+
+        if e == 0:
+            continue
+
+        if instrument.collector is not None:
+            instrument.record('multiexp', base, e)
+
+        base = base % N
+        if e < 0:
+            base = instrument.inverse(base, N)
+            e = -e
+
+        w = window or window_size(e.bit_length())
+        table = odd_powers(base, w, N)
+
+        for pos, digit in recode(e, w):
+            schedule.setdefault(pos, []).append(table[digit >> 1])
+
+        top = max(top, e.bit_length() - 1)
+
+    acc = None
+
+    for i in range(top, -1, -1):
+        if acc is not None:
+            acc = (acc * acc) % N
+
+        for factor in schedule.get(i, ()):
+            if acc is None:
+                acc = factor
+            else:
+                acc = (acc * factor) % N
+
+    for factor in fixed:
+        acc = factor if acc is None else (acc * factor) % N
+
+    if acc is None:
+        return 1 % N
+
+    return acc
@@ -0,0 +1,102 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Self-authenticating round 0 nonces
+
+A nonce is a single integer, so the recipient side of the protocol is
+unchanged:
+
+    n1 = random (lo bits) || timestamp (32 bits) || tag (128 bits)
+
+where tag is HMAC-SHA256(key, random || timestamp) truncated to 128 bits.
+Any issuer holding the key can check a nonce it did not hand out itself,
+so round 2 needs no per-session state. A nonce stays valid for ttl seconds
+and may be used more than once in that time.
+'''
+
+import binascii
+import hashlib
+import hmac
+import os
+import struct
+import time
+
+from idemix.utils import randomness
+from idemix.utils.arith import integer
+
+from idemix.settings import lo
+
+time_bits = 32
+tag_bits = 128
+
+# seconds a nonce may appear to come from the future, for clock drift
+# between the issuers sharing a key
+max_skew = 5
+
+stamp = struct.Struct('>I')
+
+
+class StatelessNonces:
+    """
+    MAC-tagged round 0 nonces
+
+    >>> nonces = StatelessNonces(b'k' * 32, ttl=60)
+    >>> n1 = nonces.new()
+    >>> (nonces.check(n1), StatelessNonces(b'k' * 32).check(n1))
+    (True, True)
+    >>> (StatelessNonces(b'x' * 32).check(n1), nonces.check(n1 ^ 1), nonces.check(n1 ^ (1 << tag_bits)))
+    (False, False, False)
+    >>> expired = StatelessNonces(b'k' * 32, ttl=0)
+    >>> n1 = expired.new()
+    >>> time.sleep(1.1)
+    >>> expired.check(n1)
+    False
+    """
+
+    def __init__(self, key=None, ttl=300, rng=None):
+        self.key = os.urandom(32) if key is None else key
+        self.ttl = ttl
+        self.rng = randomness.get(rng)
+
+    def __tag(self, r, t):
+        raw = binascii.unhexlify('%0*x' % (2 * ((lo + 7) // 8), r)) + stamp.pack(t)
+        digest = hmac.new(self.key, raw, hashlib.sha256).digest()
+
+        return int(binascii.hexlify(digest[:tag_bits // 8]), 16)
+
+    def new(self):
+        r = int(self.rng.randomBits(lo))
+        t = int(time.time())
+
+        return integer((((r << time_bits) | t) << tag_bits) | self.__tag(r, t))
+
+    def check(self, n1):
+        """Returns True if n1 was made with this key and has not expired"""
+        n = int(n1)
+
+        if n < 0 or n.bit_length() > lo + time_bits + tag_bits:
+            return False
+
+        tag = n & ((1 << tag_bits) - 1)
+        t = (n >> tag_bits) & ((1 << time_bits) - 1)
+        r = n >> (tag_bits + time_bits)
+
+        if not -max_skew <= time.time() - t <= self.ttl:
+            return False
+
+        return hmac.compare_digest(('%032x' % tag).encode('ascii'), ('%032x' % self.__tag(r, t)).encode('ascii'))
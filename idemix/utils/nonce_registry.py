@@ -0,0 +1,191 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Registries of the verifier nonces handed out and not used yet
+
+A registry records every nonce with add(nv) and consume(nv) returns True
+only once per recorded nonce, within its lifetime, so a replayed proof is
+rejected before any exponentiation. Both operations are O(1) and the
+memory is bounded by capacity. A registry fails closed: a nonce is never
+forgotten before it expires, and when there is no room left for one more,
+add raises RegistryFull, so no nonce is handed out that could not be
+checked.
+
+NonceRegistry lives in one process. SharedNonceRegistry keeps its table in
+an anonymous shared mapping: create it before forking the workers and
+every worker sees the nonces added by the others.
+'''
+
+import binascii
+import hashlib
+import mmap
+import multiprocessing
+import struct
+import threading
+import time
+
+
+class RegistryFull(Exception):
+    'Raised by add when a registry cannot take a nonce without forgetting a live one'
+    pass
+
+
+class NonceRegistry:
+    """
+    Rotating generations of nonce sets. A nonce lives for at least ttl and at
+    most 2 * ttl seconds. At most capacity nonces are kept, counting those of
+    the previous generation until it is retired.
+
+    >>> registry = NonceRegistry(ttl=60, capacity=2)
+    >>> registry.add(1)
+    >>> registry.add(2)
+    >>> try:
+    ...     registry.add(3)
+    ... except RegistryFull as e:
+    ...     print(e)
+    nonce registry full
+    >>> registry.consume(1), registry.consume(1), registry.consume(3)
+    (True, False, False)
+    >>> registry.add(3)
+    >>> registry.started -= 60
+    >>> registry.consume(2)
+    True
+    >>> registry.started -= 60
+    >>> registry.consume(3)
+    False
+    """
+
+    def __init__(self, ttl=300, capacity=1 << 20):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.lock = threading.Lock()
+
+        self.current = set()
+        self.previous = set()
+        self.started = time.time()
+
+    def __rotate(self, now):
+        age = now - self.started
+
+        # the nonces of the previous generation are at least ttl old
+        if age >= self.ttl:
+            self.previous = self.current if age < 2 * self.ttl else set()
+            self.current = set()
+            self.started = now
+
+    def add(self, nv):
+        """Records nv, raises RegistryFull if capacity nonces are live"""
+        with self.lock:
+            self.__rotate(time.time())
+
+            if len(self.current) + len(self.previous) >= self.capacity:
+                raise RegistryFull('nonce registry full')
+
+            self.current.add(int(nv))
+
+    def consume(self, nv):
+        """Returns True if nv was added, has not expired and was not consumed before"""
+        nv = int(nv)
+
+        with self.lock:
+            self.__rotate(time.time())
+
+            for generation in (self.current, self.previous):
+                if nv in generation:
+                    generation.remove(nv)
+                    return True
+
+        return False
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+
+class SharedNonceRegistry:
+    """
+    Fixed-size hash table of nonce fingerprints and expiry times in shared
+    memory. Each nonce hashes to a bucket of `ways` slots, reused once
+    expired or consumed; adding to a bucket of live nonces raises
+    RegistryFull.
+
+    >>> registry = SharedNonceRegistry(ttl=60, capacity=2, ways=2)
+    >>> registry.add(1)
+    >>> registry.add(2)
+    >>> try:
+    ...     registry.add(3)
+    ... except RegistryFull as e:
+    ...     print(e)
+    nonce registry full
+    >>> registry.consume(2), registry.consume(2), registry.consume(3)
+    (True, False, False)
+    >>> registry.add(3)
+    >>> registry.consume(3), registry.consume(1)
+    (True, True)
+    >>> registry.close()
+    """
+
+    slot = struct.Struct('=16sd')
+
+    def __init__(self, ttl=300, capacity=1 << 16, ways=8):
+        self.ttl = ttl
+        self.ways = ways
+        self.buckets = max(1, capacity // ways)
+
+        self.table = mmap.mmap(-1, self.buckets * ways * self.slot.size)
+        self.lock = multiprocessing.Lock()
+
+    def __locate(self, nv):
+        digest = hashlib.sha256(('%x' % int(nv)).encode('ascii')).digest()
+        bucket = int(binascii.hexlify(digest[16:24]), 16) % self.buckets
+
+        return digest[:16], bucket * self.ways * self.slot.size
+
+    def __slots(self, offset):
+        size = self.slot.size
+
+        return [(offset + i * size,) + self.slot.unpack_from(self.table, offset + i * size) for i in range(self.ways)]
+
+    def add(self, nv):
+        """Records nv, raises RegistryFull if its bucket only holds live nonces"""
+        fingerprint, offset = self.__locate(nv)
+        now = time.time()
+
+        with self.lock:
+            slots = self.__slots(offset)
+            free = [position for position, f, expiry in slots if expiry < now]
+
+            if not free:
+                raise RegistryFull('nonce registry full')
+
+            self.slot.pack_into(self.table, free[0], fingerprint, now + self.ttl)
+
+    def consume(self, nv):
+        """Returns True if nv was added, has not expired and was not consumed before"""
+        fingerprint, offset = self.__locate(nv)
+        now = time.time()
+
+        with self.lock:
+            for position, f, expiry in self.__slots(offset):
+                if f == fingerprint and expiry >= now:
+                    self.slot.pack_into(self.table, position, fingerprint, 0.0)
+                    return True
+
+        return False
+
+    def close(self):
+        self.table.close()
@@ -31,8 +31,10 @@ Specification of the Identity Mixer Cryptographic Library
  '''
 import hashlib
 
-from charm.core.math.integer import integer, random, randomPrime, randomBits
-from charm.toolbox.PKSig import PKSig
+from idemix.utils import instrument
+from idemix.utils import randomness
+from idemix.utils.arith import integer, random
+from idemix.utils.multiexp import multiexp
 
 
 def SHA1(bytes1):
@@ -41,23 +43,22 @@ def SHA1(bytes1):
     return s1.digest()
 
 
-def randomQR(n):
-    return random(n) ** 2
+def randomQR(n, rng=None):
+    return instrument.modexp(randomness.get(rng).random(n), 2, n)
 
 
 debug = False
 
 
-class Sig_CL03_Idmx(PKSig):
+class Sig_CL03_Idmx:
     """
-    >>> from charm.toolbox.conversion import Conversion
     >>> pksig = Sig_CL03_Idmx()
     >>> p = integer(333437049425486136095925931727629203622119239282802038455917646172563395024265917241890473852501318262109839243221497854682815506880304349748481648877420618747530394310060738051284980323398797638078562462943477904211178707988798971266777314022673227003284335883622084916018185539789562312940907090712386355299)
     >>> q = integer(294092988306368388636535355362351220952777074915662080329740789451817968606482246364359892865057621298389179478994706465098262699509935804409002480293234947971872131356003427444279672200378079370695651721652248116723483318427208508192689675310517884904089979454005634358395042846262967137935407297336359215239)
-    >>> (public_key, secret_key) = pksig.keygen(1024, p, q)
+    >>> (public_key, secret_key) = pksig.keygen(p, q)
     >>> m = {}
     >>> j = 16
-    >>> for i in range(1, j + 1): m[str(i)] = integer(SHA1(Conversion.IP2OS(random(public_key['N']))))
+    >>> for i in range(1, j + 1): m[str(i)] = integer(SHA1(str(random(public_key['N'])).encode()))
     >>> signature = pksig.sign(public_key, secret_key, m)
     >>> pksig.verify(public_key, m, signature)
     True
@@ -69,7 +70,7 @@ class Sig_CL03_Idmx(PKSig):
     # lr = security parameter required in the proof of security of 
     #	   the credential system // 80 bits according to p. 40
 
-    def __init__(self, lnin=2048, lmin=256, lrin=80, lin=16, loin=80, lein=597, secparam=1024):
+    def __init__(self, lnin=2048, lmin=256, lrin=80, lin=16, loin=80, lein=597, secparam=1024, primes=None, rng=None):
         global ln, lm, le, l, lr, lo
         lo = loin
         lm = lmin
@@ -78,60 +79,96 @@ class Sig_CL03_Idmx(PKSig):
         ln = lnin
         lr = lrin
 
+        # PrimeReservoir of primes for e, None to search every prime
+        self.primes = primes
+        self.rng = randomness.get(rng)
+
+    @instrument.step('cl03.keygen')
     def keygen(self, p, q):
 
         N = p * q
 
-        Xz = integer(random(N))
+        Xz = integer(self.rng.random(N))
         Xr = {}
 
         for i in range(1, l + 1):
-            Xr[str(i)] = integer(random(N))
+            Xr[str(i)] = integer(self.rng.random(N))
 
-        S = randomQR(N)
-        Z = S ** Xz
+        S = randomQR(N, self.rng)
+        Z = instrument.modexp(S, Xz, N)
 
         R = {}
 
         for i in range(1, l + 1):
-            R[str(i)] = S ** Xr[str(i)]
+            R[str(i)] = instrument.modexp(S, Xr[str(i)], N)
 
         pk = {'N': N, 'R': R, 'S': S, 'Z': Z}
         sk = {'p': p, 'q': q}
 
         return (pk, sk)
 
+    def precompute(self, sk):
+        """
+        Returns a copy of sk caching the values derived from p and q: phi(N),
+        p - 1, q - 1 and q^-1 mod p. With them sign takes e-th roots modulo p
+        and q separately and recombines them with the CRT.
+        """
+        p = sk['p']
+        q = sk['q']
+
+        sk = dict(sk)
+        sk['p-1'] = p - 1
+        sk['q-1'] = q - 1
+        sk['phi_N'] = sk['p-1'] * sk['q-1']
+        sk['qInv'] = instrument.inverse(q, p)
+
+        return sk
+
+    def root(self, pk, sk, x, e):
+        """Returns x ** (e ** -1 mod phi(N)) mod N"""
+        if 'qInv' not in sk:
+            phi_N = (sk['p'] - 1) * (sk['q'] - 1)
+
+            return instrument.modexp(x, instrument.inverse(e, phi_N), pk['N'])
+
+        p = sk['p']
+        q = sk['q']
+
+        xp = instrument.modexp(x % p, instrument.inverse(e, sk['p-1']), p)
+        xq = instrument.modexp(x % q, instrument.inverse(e, sk['q-1']), q)
+        h = ((xp - xq) * sk['qInv']) % p
+
+        return (xq + q * h) % pk['N']
+
+    @instrument.step('cl03.sign')
     def sign(self, pk, sk, m, v=0, u=0, e=0):
 
         if (e == 0):
-            e = randomPrime(le)
+            e = self.rng.randomPrime(le) if self.primes is None else self.primes.take()
 
         lv = ln + lm + lr
 
         if (v == 0):
-            v = integer(randomBits(lv))
+            v = integer(self.rng.randomBits(lv))
 
         R = pk['R']
 
-        Cx = 1 % pk['N']
+        pairs = [(R[str(i)], m[str(i)]) for i in range(1, len(m) + 1)]
+        pairs.append((pk['S'], v))
 
-        for i in range(1, len(m) + 1):
-            Cx = Cx * (R[str(i)] ** m[str(i)])
-
-        phi_N = (sk['p'] - 1) * (sk['q'] - 1)
-        e2 = e % phi_N
+        Cx = multiexp(pairs, pk['N'])
 
         if (u != 0):
-            u = u % pk['N']
-            Cx = Cx * u
+            Cx = Cx * u % pk['N']
 
-        q = pk['Z'] / (Cx * (pk['S'] ** v)) % pk['N']
-        a = q ** (e2 ** -1) % pk['N']
+        q = pk['Z'] * instrument.inverse(Cx, pk['N']) % pk['N']
+        a = self.root(pk, sk, q, e)
 
         sig = {'A': a, 'Q': q, 'e': e, 'v': v}
 
         return sig
 
+    @instrument.step('cl03.verify')
     def verify(self, pk, m, sig):
         if debug: print("\nVERIFY\n\n")
 
@@ -139,12 +176,11 @@ class Sig_CL03_Idmx(PKSig):
 
         R = pk['R']
 
-        Cx = 1 % pk['N']
-
-        for i in range(1, len(m) + 1):
-            Cx = Cx * (R[str(i)] ** m[str(i)])
+        pairs = [(R[str(i)], m[str(i)]) for i in range(1, len(m) + 1)]
+        pairs.append((sig['A'], sig['e']))
+        pairs.append((pk['S'], sig['v']))
 
-        rhs = (Cx * (sig['A'] ** sig['e']) * (pk['S']) ** sig['v']) % pk['N']
+        rhs = multiexp(pairs, pk['N'])
 
         if (sig['e'] <= 2 ** (le - 1) or sig['e'] >= 2 ** (le)):
             return False
@@ -156,8 +192,8 @@ class Sig_CL03_Idmx(PKSig):
 
     def randomize(self, pk, sig):
 
-        rA = integer(randomBits(ln + lo))
-        aP = (sig['A'] * (pk['S'] ** rA)) % pk['N']
+        rA = integer(self.rng.randomBits(ln + lo))
+        aP = (sig['A'] * instrument.modexp(pk['S'], rA, pk['N'])) % pk['N']
         vP = sig['v'] - (sig['e'] * rA)
         eP = sig['e'] - (2 ** (le - 1))
 
@@ -166,4 +202,4 @@ class Sig_CL03_Idmx(PKSig):
         return sigP
 
     def randSign(self, pk, m, sig):
-        print "TODO"
+        print("TODO")
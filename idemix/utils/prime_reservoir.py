@@ -0,0 +1,167 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Reservoir of random primes
+
+Certificate exponents e, and the r of the issuer's correctness proof, are
+random primes of the idemix interval [2^(le-1), 2^(le-1) + 2^(lePrime-1)).
+Their search time varies widely from one prime to the next, so a reservoir
+keeps primes found ahead of time by a pool of worker processes: when fewer
+than `low` primes are left, the workers are asked for enough primes to get
+back to `high`. take() is O(1) and searches a prime on the spot only when the
+reservoir is empty.
+
+The workers cannot share the caller's provider, so every job gets a 256-bit
+seed drawn from it and searches with the SHA-256 stream of
+idemix.utils.randomness.DeterministicRandomness over that seed. A job that
+fails is counted in `failures` and its prime is searched again by a later
+refill.
+'''
+
+import collections
+import multiprocessing
+import sys
+import threading
+
+from idemix.settings import le, lePrime
+from idemix.utils import randomness
+from idemix.utils.arith import integer
+
+
+def _random_prime(bits, interval, seed):
+    try:
+        return int(randomness.DeterministicRandomness(seed).randomPrime(bits, interval))
+    except Exception:
+        return None
+
+
+class PrimeReservoir:
+    """
+    Primes of `bits` bits found ahead of time, in [2^(bits-1), 2^(bits-1) +
+    2^(interval-1)), or anywhere in the bits-bit range if interval is None.
+    They are drawn from rng, the default provider if None.
+
+    >>> primes = PrimeReservoir(low=1, high=4, background=False, rng=randomness.DeterministicRandomness(1))
+    >>> primes.fill()
+    >>> e = primes.take()
+    >>> 2 ** (le - 1) <= e < 2 ** (le - 1) + 2 ** (lePrime - 1)
+    True
+    >>> (len(primes), primes.hits, primes.misses)
+    (3, 1, 0)
+    """
+
+    def __init__(self, bits=le, low=16, high=64, processes=1, background=True, interval=lePrime, rng=None):
+        if not 0 <= low <= high:
+            raise ValueError('watermarks must satisfy 0 <= low <= high')
+
+        self.bits = bits
+        self.interval = interval
+        self.low = low
+        self.high = high
+        self.processes = processes
+        self.rng = randomness.get(rng)
+
+        self.primes = collections.deque()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.pool = None
+
+        # primes served from the reservoir, and searched on the spot
+        self.hits = 0
+        self.misses = 0
+        # worker jobs that raised
+        self.failures = 0
+
+        # error_callback is new in python 3; on python 2 _random_prime
+        # catches the errors of the search itself
+        self.callbacks = {'callback': self.__found}
+        if sys.version_info[0] >= 3:
+            self.callbacks['error_callback'] = self.__failed
+
+        if background:
+            self.start()
+
+    def start(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.processes)
+            self.__refill()
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+        with self.lock:
+            self.pending = 0
+
+    def fill(self):
+        """Searches primes in the calling process until the reservoir holds high of them"""
+        while len(self.primes) < self.high:
+            self.__add(int(self.rng.randomPrime(self.bits, self.interval)))
+
+    def take(self):
+        with self.lock:
+            if self.primes:
+                prime = integer(self.primes.popleft())
+                self.hits += 1
+            else:
+                prime = None
+                self.misses += 1
+
+        if prime is None:
+            prime = self.rng.randomPrime(self.bits, self.interval)
+
+        self.__refill()
+
+        return prime
+
+    def __len__(self):
+        return len(self.primes)
+
+    def __add(self, prime):
+        with self.lock:
+            self.primes.append(prime)
+
+    def __found(self, prime):
+        if prime is None:
+            return self.__failed(None)
+
+        with self.lock:
+            self.pending -= 1
+            self.primes.append(prime)
+
+    def __failed(self, error):
+        with self.lock:
+            self.pending -= 1
+            self.failures += 1
+
+    def __refill(self):
+        if self.pool is None:
+            return
+
+        with self.lock:
+            if len(self.primes) + self.pending >= self.low:
+                return
+
+            count = self.high - len(self.primes) - self.pending
+            self.pending += count
+
+        for i in range(count):
+            seed = int(self.rng.randomBits(256))
+            self.pool.apply_async(_random_prime, (self.bits, self.interval, seed), **self.callbacks)
@@ -0,0 +1,104 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Domain pseudonyms
+
+The pseudonym of a user in a domain is nym = g_dom ** ms mod N, where ms is
+the master secret and g_dom = H(domain) ** 2 mod N is a quadratic residue
+derived by hashing the domain name into Z_N. A user has one pseudonym per
+domain, and pseudonyms of different domains cannot be linked.
+'''
+
+import collections
+import hashlib
+import struct
+import threading
+
+from idemix.settings import lh, lm, lo
+from idemix.utils.arith import integer, powmod
+from idemix.utils.fixed_base import FixedBaseTable
+
+counter = struct.Struct('>I')
+
+
+def hash_to_group(domain, N):
+    """Returns H(domain) ** 2 mod N, H expanding SHA-256 to 128 bits more than N"""
+    if not isinstance(domain, bytes):
+        domain = domain.encode('utf-8')
+
+    digest = b''
+    i = 0
+    while 8 * len(digest) < int(N).bit_length() + 128:
+        digest += hashlib.sha256(counter.pack(i) + domain).digest()
+        i += 1
+
+    return powmod(integer(digest) % N, 2, N)
+
+
+class DomainBases:
+    """
+    LRU cache of the domain bases under the modulus of pk. A domain asked for
+    `hot` times gets a fixed-base table for exponents of `bits` bits, which
+    is kept as long as the domain stays in the cache.
+
+    >>> N = 1000003 * 1000033
+    >>> bases = DomainBases({'N': N}, size=2, hot=2, bits=32)
+    >>> bases.base('shop') == hash_to_group('shop', N) != hash_to_group('bank', N)
+    True
+    >>> table = bases.base('shop')
+    >>> (isinstance(table, FixedBaseTable), table.pow(12345) == powmod(hash_to_group('shop', N), 12345, N))
+    (True, True)
+    >>> others = [bases.base('a'), bases.base('b')]
+    >>> ('shop' in bases.entries, bases.hits, bases.misses)
+    (False, 1, 3)
+    """
+
+    def __init__(self, pk, size=128, hot=16, bits=lm + lo + lh + 1, window=4):
+        self.N = pk['N']
+        self.size = size
+        self.hot = hot
+        self.bits = bits
+        self.window = window
+        self.lock = threading.Lock()
+
+        # domain -> [base or table, uses]
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def base(self, domain):
+        """Returns the base of domain, as a FixedBaseTable once the domain is hot"""
+        with self.lock:
+            entry = self.entries.pop(domain, None)
+
+            if entry is None:
+                self.misses += 1
+                entry = [hash_to_group(domain, self.N), 0]
+            else:
+                self.hits += 1
+
+            entry[1] += 1
+            if entry[1] == self.hot:
+                entry[0] = FixedBaseTable(entry[0], self.N, self.bits, self.window)
+
+            self.entries[domain] = entry
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+            return entry[0]
@@ -0,0 +1,208 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Randomness providers
+
+A provider hands out random numbers of the arithmetic backend:
+
+    randomBits(n)       uniform in [0, 2 ** n)
+    random(n)           uniform in [0, n)
+    randomPrime(bits)   random bits-bit prime
+    randomPrime(bits, interval)
+                        random prime in [2 ** (bits - 1), 2 ** (bits - 1) + 2 ** (interval - 1)),
+                        the interval of the idemix certificate exponents e
+
+Issuer, Recipient, Verifier, the provers, CM_DF02 and Sig_CL03_Idmx take one
+as their rng argument; without it they use the default provider, which the
+module-level functions below also draw from. Both providers derive from
+BufferedRandomness and read their bytes from a buffer refilled in large
+chunks:
+
+    SystemRandomness            os.urandom; the buffer is dropped in a forked
+                                child, so parent and child never share bytes
+    DeterministicRandomness     SHA-256 in counter mode over a seed, for
+                                reproducible benchmarks and profiling only; a
+                                forked child mixes its pid into the seed
+'''
+
+import hashlib
+import os
+import struct
+import threading
+
+from idemix.utils.arith import integer, isPrime
+
+counter = struct.Struct('>Q')
+
+
+class BufferedRandomness:
+    """
+    Base class of the providers, serving bits from a buffer refilled `chunk`
+    bytes at a time. Subclasses implement generate(), and check() if the
+    buffer must not outlive some condition such as a fork.
+    """
+
+    def __init__(self, chunk=8192):
+        self.chunk = chunk
+        self.lock = threading.Lock()
+        self.buffer = b''
+        self.offset = 0
+
+    def generate(self, n):
+        """Returns n fresh random bytes"""
+        raise NotImplementedError
+
+    def randomBytes(self, n):
+        with self.lock:
+            self.check()
+
+            if len(self.buffer) - self.offset < n:
+                self.buffer = self.buffer[self.offset:] + self.generate(max(self.chunk, n))
+                self.offset = 0
+
+            data = self.buffer[self.offset:self.offset + n]
+            self.offset += n
+
+        return data
+
+    def check(self):
+        'Called with the lock held before the buffer is read'
+        pass
+
+    def randomBits(self, n):
+        if n <= 0:
+            return integer(0)
+
+        size = (n + 7) // 8
+
+        return integer(self.randomBytes(size)) >> (8 * size - n)
+
+    def random(self, n):
+        n = int(n)
+
+        if n <= 0:
+            raise ValueError('empty range')
+
+        bits = (n - 1).bit_length()
+        while True:
+            x = self.randomBits(bits)
+            if x < n:
+                return x
+
+    def randomPrime(self, bits, interval=None):
+        if interval is None:
+            interval = bits
+
+        while True:
+            x = (1 << (bits - 1)) + (self.randomBits(interval - 1) | 1)
+            if isPrime(x):
+                return x
+
+
+class SystemRandomness(BufferedRandomness):
+    'os.urandom, read chunk bytes at a time'
+
+    def __init__(self, chunk=8192):
+        BufferedRandomness.__init__(self, chunk)
+        self.pid = os.getpid()
+
+    def generate(self, n):
+        return os.urandom(n)
+
+    def check(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.buffer = b''
+            self.offset = 0
+
+
+class DeterministicRandomness(BufferedRandomness):
+    """
+    SHA-256(seed || counter) stream. Every run with the same seed draws the
+    same numbers, as long as the calls happen in the same order. Not for
+    production keys or proofs.
+
+    A forked child would replay the parent's stream, so on its first draw it
+    drops the buffer and continues with SHA-256(seed || pid || counter) from
+    counter 0. The children of a run are only reproducible if they get the
+    same pids.
+
+    >>> rng, replay = DeterministicRandomness(7), DeterministicRandomness(7)
+    >>> rng.randomBits(64) == replay.randomBits(64)
+    True
+    >>> following = replay.randomBits(64)
+    >>> pid = os.fork()
+    >>> if pid == 0:
+    ...     os._exit(1 if rng.randomBits(64) == following else 0)
+    >>> os.waitpid(pid, 0)[1]
+    0
+    >>> rng.randomBits(64) == following
+    True
+    """
+
+    def __init__(self, seed=0, chunk=8192):
+        BufferedRandomness.__init__(self, chunk)
+        self.seed = seed if isinstance(seed, bytes) else str(seed).encode('utf-8')
+        self.counter = 0
+        self.pid = os.getpid()
+
+    def check(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.seed = self.seed + counter.pack(self.pid)
+            self.counter = 0
+            self.buffer = b''
+            self.offset = 0
+
+    def generate(self, n):
+        blocks = []
+        for i in range((n + 31) // 32):
+            blocks.append(hashlib.sha256(self.seed + counter.pack(self.counter)).digest())
+            self.counter += 1
+
+        return b''.join(blocks)[:n]
+
+
+default = SystemRandomness()
+
+
+def set_default(provider):
+    """Installs the default provider, None for a new SystemRandomness. Returns the previous one."""
+    global default
+
+    old = default
+    default = SystemRandomness() if provider is None else provider
+
+    return old
+
+
+def get(rng=None):
+    """Returns rng, or the default provider if rng is None"""
+    return default if rng is None else rng
+
+
+def randomBits(n):
+    return default.randomBits(n)
+
+
+def random(n):
+    return default.random(n)
+
+
+def randomPrime(bits, interval=None):
+    return default.randomPrime(bits, interval)
@@ -0,0 +1,151 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Safe prime generation with a combined sieve
+
+| From: "M. Wiener. Safe prime generation with a combined sieve"
+| Published in: Cryptology ePrint Archive, Report 2003/186
+| Available from: https://eprint.iacr.org/2003/186
+| Notes: An interval of odd candidates p' is sieved at once, removing every
+|   p' such that p' or 2p' + 1 has a small factor. The survivors get a base 2
+|   Fermat test on both numbers before the full primality test of p'; once
+|   p' is prime, the Fermat test is a primality proof for 2p' + 1
+|   (Pocklington). Intervals are searched in parallel by a process pool.
+
+* type:		prime generation
+* setting:	integer groups
+'''
+
+import multiprocessing
+import time
+
+from idemix.utils import randomness
+from idemix.utils.arith import integer, isPrime, powmod
+
+sieve_bound = 1 << 14
+interval = 4096
+
+
+def _odd_primes_below(n):
+    sieve = bytearray([1]) * n
+    sieve[0:2] = bytearray(2)
+
+    for i in range(2, int(n ** 0.5) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = bytearray(len(range(i * i, n, i)))
+
+    return [i for i in range(3, n) if sieve[i]]
+
+
+small_primes = _odd_primes_below(sieve_bound)
+
+
+def _fermat(x):
+    return powmod(2, x - 1, x) == 1
+
+
+def search_interval(start, bits, size=interval):
+    """
+    Looks for a prime p' in start, start + 2, ..., start + 2 * (size - 1),
+    with 2p' + 1 also prime and p' exactly bits bits long. start must be odd.
+    Returns (p' or None, number of candidates that survived the sieve).
+    """
+    alive = bytearray([1]) * size
+
+    for s in small_primes:
+        if s >= start:
+            break
+
+        # start + 2k == 0 (mod s), and 2 * (start + 2k) + 1 == 0 (mod s)
+        inv2 = (s + 1) // 2
+        k = (-start * inv2) % s
+        alive[k::s] = bytearray(len(range(k, size, s)))
+        k = ((-1 - 2 * start) * inv2 * inv2) % s
+        alive[k::s] = bytearray(len(range(k, size, s)))
+
+    tested = 0
+
+    for k in range(size):
+        if not alive[k]:
+            continue
+
+        x = start + 2 * k
+        if x.bit_length() > bits:
+            break
+
+        tested += 1
+
+        if _fermat(x) and _fermat(2 * x + 1) and isPrime(x):
+            return x, tested
+
+    return None, tested
+
+
+def _random_start(bits, rng):
+    x = int(rng.randomBits(bits))
+
+    return x | (1 << (bits - 1)) | 1
+
+
+def _search(job):
+    return search_interval(*job)
+
+
+def safe_prime(bits, processes=None, rng=None):
+    """
+    Returns (p, stats) where p = 2p' + 1 is a safe prime and p' a random
+    bits-bit prime. processes defaults to the number of cores; with 1 the
+    search runs in the calling process. stats reports the number of
+    intervals sieved, the candidates that went through primality tests and
+    the elapsed time.
+
+    >>> (p, stats) = safe_prime(64, processes=1, rng=randomness.DeterministicRandomness(1))
+    >>> (int(p).bit_length(), isPrime(p), isPrime((p - 1) // 2), stats['intervals'] >= 1)
+    (65, True, True, True)
+    """
+    rng = randomness.get(rng)
+    start = time.time()
+    stats = {'intervals': 0, 'candidates': 0}
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    found = None
+
+    if processes == 1:
+        while found is None:
+            found, tested = search_interval(_random_start(bits, rng), bits)
+            stats['intervals'] += 1
+            stats['candidates'] += tested
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            while found is None:
+                jobs = [(_random_start(bits, rng), bits) for i in range(processes)]
+                for found, tested in pool.imap_unordered(_search, jobs):
+                    stats['intervals'] += 1
+                    stats['candidates'] += tested
+                    if found is not None:
+                        break
+        finally:
+            pool.terminate()
+            pool.join()
+
+    stats['seconds'] = time.time() - start
+
+    return integer(2 * found + 1), stats
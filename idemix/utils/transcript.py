@@ -0,0 +1,82 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+
+from idemix.utils.arith import integer
+
+from idemix.utils.wire import encode_value
+
+
+class Transcript:
+    """
+    Fiat-Shamir transcript. Values are written with the canonical encoding of
+    idemix.utils.wire (dicts in sorted key order) into a buffer that is fed to
+    SHA-256 only when the state is copied or the challenge is taken.
+
+    >>> prefix = Transcript().append(1, {'y': 2, 'x': 3})
+    >>> prefix.copy().challenge() == Transcript().append(1).append({'x': 3, 'y': 2}).challenge()
+    True
+    >>> prefix.copy().append(4).challenge() == prefix.copy().challenge()
+    False
+    >>> prefix.copy().append(4).challenge() == prefix.copy().append(4).challenge()
+    True
+    """
+
+    def __init__(self, h=None):
+        self.h = hashlib.sha256() if h is None else h
+        self.buffer = bytearray()
+
+    def append(self, *values):
+        for value in values:
+            encode_value(value, self.buffer)
+
+        return self
+
+    def copy(self):
+        self.__flush()
+
+        return Transcript(self.h.copy())
+
+    def challenge(self):
+        self.__flush()
+
+        return integer(self.h.digest())
+
+    def __flush(self):
+        if self.buffer:
+            self.h.update(self.buffer)
+            del self.buffer[:]
+
+
+def issuer_transcript(context, pk_i):
+    """
+    Returns the transcript prefix shared by every proof under an issuer key:
+    the context and the public key. Proofs start from a copy() of it.
+    """
+    pk = dict((k, v) for k, v in pk_i.items() if k in ('N', 'S', 'Z', 'Ro', 'R'))
+
+    return Transcript().append(context, pk)
+
+
+def combined_transcript(transcripts):
+    """
+    Returns the transcript prefix of a proof over credentials of several
+    issuer keys: the challenges of their issuer transcripts, in order.
+    """
+    return Transcript().append([t.copy().challenge() for t in transcripts])
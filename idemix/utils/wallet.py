@@ -0,0 +1,225 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Credential wallet
+
+Credentials ({'attributes': ..., 'signature': ...}) are appended to a
+single file, or to a buffer for a wallet without a file:
+
+    header   magic 'IDMXWAL', version (1 byte)
+    records  issuer key fingerprint (16 bytes), body length (4 bytes),
+             ids length (2 bytes), attribute ids joined by ',' (ASCII),
+             body: the credential as a wire 'credential' message
+
+Opening a wallet reads the record headers and ids only. In memory every
+credential is a slot number: its offset in the file, kept in an array, and
+its entries in the index fingerprint -> attribute id -> slots, so find()
+is a few set intersections instead of a scan. A credential is decoded from
+the mapped file when it is asked for with get().
+'''
+
+import array
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+from idemix.utils import wire
+
+MAGIC = b'IDMXWAL'
+VERSION = 1
+
+header = struct.Struct('>7sB')
+record = struct.Struct('>16sIH')
+
+
+def key_fingerprint(pk):
+    """First 16 bytes of SHA-256 over the public generators of an issuer key"""
+    out = bytearray()
+    wire.encode_value(dict((name, pk[name]) for name in ('N', 'S', 'Z', 'Ro', 'R')), out)
+
+    return hashlib.sha256(bytes(out)).digest()[:16]
+
+
+class Wallet:
+    """
+    Append-only store of credentials, indexed by issuer key and attribute
+    ids. With a path the wallet is kept in that file, created if missing,
+    and read through a mmap; without one it lives in memory.
+
+    >>> import shutil, tempfile
+    >>> pk = {'N': 35, 'S': 4, 'Z': 9, 'Ro': 11, 'R': {'1': 2, '2': 3}}
+    >>> credential = {'attributes': {'1': 5, '2': 6}, 'signature': {'A': 12, 'e': 13, 'v': 14}}
+    >>> folder = tempfile.mkdtemp()
+    >>> wallet = Wallet(os.path.join(folder, 'wallet'))
+    >>> (wallet.add(pk, credential), wallet.add(pk, {'attributes': {'2': 7}, 'signature': credential['signature']}))
+    (0, 1)
+    >>> wallet.close()
+    >>> wallet = Wallet(os.path.join(folder, 'wallet'))
+    >>> (len(wallet), wallet.find(pk, ['2']) == [0, 1], wallet.find(pk, ['1', '2']) == [0], wallet.find(dict(pk, N=77)))
+    (2, True, True, [])
+    >>> wallet.get(0) == credential
+    True
+    >>> wallet.close()
+    >>> shutil.rmtree(folder)
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+
+        # slot -> offset of its record
+        self.offsets = array.array('L')
+        # fingerprint -> attribute id -> slots
+        self.index = {}
+
+        self.file = None
+        self.map = None
+        self.buffer = bytearray(header.pack(MAGIC, VERSION))
+
+        if path is None:
+            return
+
+        if not os.path.exists(path) or not os.path.getsize(path):
+            with open(path, 'wb') as f:
+                f.write(bytes(self.buffer))
+
+        self.buffer = None
+        self.file = open(path, 'r+b')
+        self.__remap()
+        self.__load()
+
+    def __remap(self):
+        if self.map is not None:
+            self.map.close()
+
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __data(self):
+        return self.buffer if self.buffer is not None else self.map
+
+    def __load(self):
+        data = self.map
+
+        if len(data) < header.size or header.unpack_from(data)[0] != MAGIC:
+            raise ValueError('not a credential wallet')
+        if header.unpack_from(data)[1] != VERSION:
+            raise ValueError('unsupported wallet version')
+
+        offset = header.size
+        while offset < len(data):
+            if offset + record.size > len(data):
+                raise ValueError('truncated wallet')
+
+            (fingerprint, length, ids_length) = record.unpack_from(data, offset)
+            start = offset + record.size
+            end = start + ids_length + length
+
+            if end > len(data):
+                raise ValueError('truncated wallet')
+
+            ids = str(data[start:start + ids_length].decode('ascii'))
+            self.__index(fingerprint, ids.split(',') if ids else [], offset)
+            offset = end
+
+    def __index(self, fingerprint, ids, offset):
+        slot = len(self.offsets)
+        self.offsets.append(offset)
+
+        # the slots under None are all those of the key
+        by_id = self.index.setdefault(fingerprint, {})
+        by_id.setdefault(None, array.array('L')).append(slot)
+        for id in ids:
+            by_id.setdefault(id, array.array('L')).append(slot)
+
+        return slot
+
+    def add(self, pk, credential, fingerprint=None):
+        """
+        Stores credential, issued under pk, and returns its slot. fingerprint
+        saves hashing pk when key_fingerprint(pk) is known.
+        """
+        fingerprint = fingerprint or key_fingerprint(pk)
+        ids = sorted(credential['attributes'])
+        raw_ids = ','.join(ids).encode('ascii')
+        body = wire.encode('credential', credential)
+
+        data = record.pack(fingerprint, len(body), len(raw_ids)) + raw_ids + body
+
+        with self.lock:
+            if self.buffer is not None:
+                offset = len(self.buffer)
+                self.buffer += data
+            else:
+                self.file.seek(0, os.SEEK_END)
+                offset = self.file.tell()
+                self.file.write(data)
+                self.file.flush()
+
+            return self.__index(fingerprint, ids, offset)
+
+    def get(self, slot, N=None):
+        """Decodes the credential in slot; with N its signature A is reduced mod N"""
+        with self.lock:
+            offset = self.offsets[slot]
+
+            if self.buffer is None and offset + record.size > len(self.map):
+                self.__remap()
+
+            data = self.__data()
+            (fingerprint, length, ids_length) = record.unpack_from(data, offset)
+            start = offset + record.size + ids_length
+
+            if self.buffer is None and start + length > len(self.map):
+                self.__remap()
+                data = self.map
+
+            body = bytes(data[start:start + length])
+
+        return wire.decode(body, N, 'credential')[1]
+
+    def find(self, pk, ids=(), fingerprint=None):
+        """Slots of the credentials issued under pk that hold every attribute in ids"""
+        by_id = self.index.get(fingerprint or key_fingerprint(pk))
+
+        if by_id is None:
+            return []
+
+        lists = [by_id.get(id) for id in ids] or [by_id[None]]
+        if any(slots is None for slots in lists):
+            return []
+
+        lists.sort(key=len)
+        matches = set(lists[0])
+        for slots in lists[1:]:
+            matches.intersection_update(slots)
+
+        return sorted(matches)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
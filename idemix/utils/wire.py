@@ -0,0 +1,227 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Canonical binary encoding of the protocol messages
+
+A message is a 2-byte header (message type, version) followed by one value:
+
+    integer  0x01, sign (1 byte), length (2 bytes), big-endian magnitude
+    dict     0x02, count (2 bytes), then for every key in sorted order:
+             key length (1 byte), ASCII key, value
+    list     0x03, count (2 bytes), values
+
+Dict keys are always written in sorted order, so every message has exactly
+one encoding. The decoder enforces it: it rejects dict keys that are not
+strictly increasing and integers with leading zero bytes or a negative
+zero, so two different byte strings never decode to the same message. Decoding works on a memoryview of the input; integers are read
+from slices of it without copying where the Python version allows.
+'''
+
+import binascii
+import struct
+
+from idemix.utils.arith import integer
+
+VERSION = 1
+
+INTEGER = 1
+DICT = 2
+LIST = 3
+
+# message type -> (type byte, paths of the group elements, reduced mod N)
+messages = {
+    'nonce': (1, []),
+    'p1': (2, [('U',)]),
+    'signature': (3, [('A',)]),
+    'P2': (4, []),
+    'proof': (5, [('common', 'A_prime'), ('t-values', 'Z_tilde')]),
+    # disclosed attributes, proof and nonce sent to a verifier
+    'presentation': (6, [('proof', 'common', 'A_prime'), ('proof', 't-values', 'Z_tilde')]),
+    # round 1 message and nonces sent to an issuer, and its round 2 reply
+    'issue': (7, [('p1', 'U')]),
+    'issued': (8, [('signature', 'A')]),
+    # proof over several credentials, whose parts may be under different moduli
+    'combined_proof': (9, []),
+    # stored credential, see idemix.utils.wallet
+    'credential': (10, [('signature', 'A')]),
+}
+
+header = struct.Struct('>BB')
+u8 = struct.Struct('>B')
+u16 = struct.Struct('>H')
+int_header = struct.Struct('>BBH')
+
+max_depth = 8
+
+if hasattr(int, 'from_bytes'):
+    def _from_bytes(view):
+        return int.from_bytes(view, 'big')
+else:
+    def _from_bytes(view):
+        return int(binascii.hexlify(view), 16) if len(view) else 0
+
+
+def encode_value(value, out):
+    """Appends the encoding of an integer, dict or list to the bytearray out"""
+    if isinstance(value, dict):
+        out += u8.pack(DICT) + u16.pack(len(value))
+        for raw, key in sorted((str(key).encode('ascii'), key) for key in value):
+            out += u8.pack(len(raw)) + raw
+            encode_value(value[key], out)
+    elif isinstance(value, (list, tuple)):
+        out += u8.pack(LIST) + u16.pack(len(value))
+        for item in value:
+            encode_value(item, out)
+    else:
+        v = int(value)
+        magnitude = abs(v)
+        length = (magnitude.bit_length() + 7) // 8
+        out += int_header.pack(INTEGER, 1 if v < 0 else 0, length)
+        if length:
+            out += binascii.unhexlify('%0*x' % (2 * length, magnitude))
+
+
+def encode(kind, message):
+    """Encodes a message of the given type, one of the keys of messages"""
+    out = bytearray(header.pack(messages[kind][0], VERSION))
+    encode_value(message, out)
+
+    return bytes(out)
+
+
+def _decode_value(view, offset, depth):
+    if depth > max_depth:
+        raise ValueError('message nested too deeply')
+
+    tag = view[offset:offset + 1].tobytes()
+
+    if tag == b'\x01':
+        (tag, sign, length) = int_header.unpack_from(view, offset)
+        offset += int_header.size
+        if offset + length > len(view):
+            raise ValueError('truncated message')
+        if sign > 1 or (sign and not length) or (length and view[offset:offset + 1].tobytes() == b'\x00'):
+            raise ValueError('integer not minimally encoded')
+        v = _from_bytes(view[offset:offset + length])
+        return integer(-v if sign else v), offset + length
+
+    if tag in (b'\x02', b'\x03'):
+        (count,) = u16.unpack_from(view, offset + 1)
+        offset += 1 + u16.size
+
+        if tag == b'\x03':
+            items = []
+            for i in range(count):
+                item, offset = _decode_value(view, offset, depth + 1)
+                items.append(item)
+            return items, offset
+
+        items = {}
+        previous = None
+        for i in range(count):
+            (length,) = u8.unpack_from(view, offset)
+            raw = view[offset + 1:offset + 1 + length].tobytes()
+            if previous is not None and raw <= previous:
+                raise ValueError('dict keys not in increasing order')
+            previous = raw
+            key = str(raw.decode('ascii'))
+            items[key], offset = _decode_value(view, offset + 1 + length, depth + 1)
+        return items, offset
+
+    raise ValueError('unknown value tag')
+
+
+def decode(data, N=None, kind=None):
+    """
+    Decodes a message and returns (kind, message). If N is given the group
+    elements of the message are reduced mod N; if kind is given the message
+    must be of that type.
+
+    >>> data = encode('p1', {'U': 300, 'c': -2, 'list': [0, {}]})
+    >>> decode(data)[1] == {'U': 300, 'c': -2, 'list': [0, {}]}
+    True
+    >>> decode(data, N=7)[1]['U'] == 6
+    True
+    >>> encode('p1', decode(data)[1]) == data
+    True
+    >>> sorted(decode(encode('P2', {2: 0, 10: 0}))[1])
+    ['10', '2']
+    >>> decode(data, kind='nonce')
+    Traceback (most recent call last):
+    ...
+    ValueError: unexpected message type
+    >>> for bad in (data[:-1], data + b'\\x00', data[:1], b'\\x02\\x07' + data[2:]):
+    ...     try:
+    ...         decode(bad)
+    ...     except ValueError as e:
+    ...         print(e)
+    truncated message
+    trailing bytes after message
+    truncated message
+    unsupported message version
+
+    Every message has one encoding only:
+
+    >>> decode(b'\\x01\\x01\\x01\\x00\\x00\\x02\\x00\\x05')
+    Traceback (most recent call last):
+    ...
+    ValueError: integer not minimally encoded
+    >>> decode(b'\\x01\\x01\\x01\\x01\\x00\\x00')
+    Traceback (most recent call last):
+    ...
+    ValueError: integer not minimally encoded
+    >>> decode(b'\\x01\\x01\\x02\\x00\\x02\\x01b\\x01\\x00\\x00\\x00\\x01a\\x01\\x00\\x00\\x00')
+    Traceback (most recent call last):
+    ...
+    ValueError: dict keys not in increasing order
+    >>> decode(b'\\x01\\x01\\x02\\x00\\x02\\x01a\\x01\\x00\\x00\\x00\\x01a\\x01\\x00\\x00\\x00')
+    Traceback (most recent call last):
+    ...
+    ValueError: dict keys not in increasing order
+    """
+    view = memoryview(data)
+
+    if len(view) < header.size:
+        raise ValueError('truncated message')
+
+    (type_byte, version) = header.unpack_from(view, 0)
+
+    if version != VERSION:
+        raise ValueError('unsupported message version')
+
+    names = [name for name, (byte, paths) in messages.items() if byte == type_byte]
+    if not names or (kind is not None and names[0] != kind):
+        raise ValueError('unexpected message type')
+
+    try:
+        message, offset = _decode_value(view, header.size, 0)
+    except struct.error:
+        raise ValueError('truncated message')
+
+    if offset != len(view):
+        raise ValueError('trailing bytes after message')
+
+    if N is not None:
+        for path in messages[names[0]][1]:
+            parent = message
+            for key in path[:-1]:
+                parent = parent.get(key, {})
+            if path[-1] in parent:
+                parent[path[-1]] = parent[path[-1]] % N
+
+    return names[0], message
@@ -16,159 +16,599 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import collections
 import hashlib
+import time
 
-from charm.core.math.integer import integer, random, randomBits
-from charm.toolbox.conversion import Conversion
-
+from idemix.provers.predicate_prover import inequality_offset, prime_product, provers
 from idemix.settings import le, lo
+from idemix.utils import instrument, randomness
+from idemix.utils.arith import integer, invert
+from idemix.utils.fixed_base import FixedBaseTable, generator
+from idemix.utils.multiexp import multiexp
+from idemix.utils.pseudonym import DomainBases
+from idemix.utils.transcript import combined_transcript, issuer_transcript
 
+# e_hat is reduced by 2 ** (le - 1) in the proof
+e_offset = 2 ** (le - 1)
+
+# raised by a proof missing a field or holding values of the wrong type,
+# which is then rejected instead of failing the whole call
+malformed = (KeyError, AttributeError, TypeError, ValueError, IndexError, ZeroDivisionError)
+
+
+def plan_bases(pk):
+    """
+    Returns the bases of the verification equations under pk, keyed by
+    ('Z',), ('Z^-1',), ('Ro',), ('S',) and ('R', id). The inverse of Z, with a
+    fixed-base table if Z has one, spares the CL equation an inversion per
+    proof for its -c exponent.
+    """
+    Z = generator(pk, 'Z')
+    Z_inv = invert(pk['Z'], pk['N'])
+
+    if isinstance(Z, FixedBaseTable):
+        Z_inv = FixedBaseTable(Z_inv, pk['N'], Z.bits, Z.window)
+
+    bases = {('Z',): Z, ('Z^-1',): Z_inv, ('Ro',): generator(pk, 'Ro'), ('S',): generator(pk, 'S')}
+    for id in pk['R']:
+        bases[('R', id)] = generator(pk, 'R', id)
+
+    return bases
+
+
+class VerificationPlan:
+    """
+    Verification equation of the CL proofs with a given set of disclosed
+    and of hidden attributes:
+
+        T_hat = (Z^-1) ** c * Ro ** m_hat_0 * S ** v_prime_hat
+                * prod(R_i ** (c * m_i), i disclosed) * prod(R_j ** m_hat_j, j hidden)
+                * A_prime ** (e_hat + c * 2 ** (le - 1))
+
+    The order of the terms and their bases are fixed when the plan is built.
+    """
+
+    def __init__(self, bases, disclosed, hidden):
+        self.disclosed = sorted(disclosed)
+        self.hidden = sorted(hidden)
+
+        self.keys = [('Z^-1',), ('Ro',), ('S',)]
+        self.keys += [('R', id) for id in self.disclosed]
+        self.keys += [('R', id) for id in self.hidden]
+
+        self.bases = [bases[key] for key in self.keys]
+
+    def exponents(self, m, P):
+        """
+        Returns the exponents of the plan's bases, in the order of keys, and
+        the (base, exponent) pair of A_prime.
+        """
+        c = P['c']
+        s = P['s']
+        m_hat = s['m_hat']
+
+        exps = [c, m_hat['0'], s['v_prime_hat']]
+        exps += [c * m[id] for id in self.disclosed]
+        exps += [m_hat[id] for id in self.hidden]
+
+        return exps, (P['common']['A_prime'], s['e_hat'] + c * e_offset)
+
+    def evaluate(self, m, P, N):
+        exps, proof_term = self.exponents(m, P)
+
+        return multiexp(list(zip(self.bases, exps)) + [proof_term], N)
+
+
+def _combined_part(P, proof):
+    'One part of a combined proof P, as a single-credential proof'
+    s = dict(proof['s'])
+    s['m_hat'] = dict(s['m_hat'])
+    s['m_hat']['0'] = P['m_hat_0']
+
+    return {'c': P['c'], 's': s, 'common': proof['common']}
+
+
+def _predicate_equations(predicate, common, s, m_hat, c):
+    """
+    Verification equations of the proof of a predicate, as a dict from
+    t-value name to (fixed, own): (plan_bases key, exponent) pairs and
+    (commitment, exponent) pairs. m_hat is the CL response of the attribute.
+    """
+    Z = ('Z',)
+    S = ('S',)
+
+    if predicate['type'] == 'inequality':
+        a, k = inequality_offset(predicate['op'], predicate['bound'])
+        T_delta = common['T_delta']
+        T = [common['T%d' % i] for i in range(1, 5)]
+        u_hat = [s['u%d' % i] for i in range(1, 5)]
+
+        equations = {'T_delta': ([(Z, c * k + a * m_hat), (S, s['r_delta'])], [(T_delta, -1 * c)]),
+                     'Q': ([(S, s['alpha'])], list(zip(T, u_hat)) + [(T_delta, -1 * c)])}
+        for i in range(1, 5):
+            equations['T%d' % i] = ([(Z, u_hat[i - 1]), (S, s['r%d' % i])], [(T[i - 1], -1 * c)])
+
+        return equations
+
+    mr = prime_product(predicate['primes'])
+    C = common['C']
+
+    equations = {'C': ([(Z, m_hat), (S, s['r'])], [(C, -1 * c)])}
+    if predicate['type'] == 'and':
+        equations['C0'] = ([(Z, mr * s['mh']), (S, s['r'])], [(C, -1 * c)])
+    else:
+        equations['Z'] = ([(Z, mr * s['b'] - c), (S, s['r_prime'])], [(C, s['a'])])
+
+    return equations
 
-class Verifier:
-    'Idemix Verifier'
 
-    def __init__(self, pk_i, context):
+def _batch_item(item):
+    '(credential, predicate, P, nv, predicates, domain) of an entry of a verifyProofs batch'
+    return tuple(item[:4]) + tuple(item[k] if len(item) > k else None for k in (4, 5))
+
+
+class Verifier:
+    """
+    Idemix Verifier
+
+    >>> from idemix.issuer import Issuer
+    >>> from idemix.recipient import Recipient
+    >>> issuer = Issuer(3, 0, 0, 255, integer(1), processes=1)
+    >>> (pk_i, sk_i) = issuer.gen_key_pair()
+    >>> user = Recipient(pk_i, integer(1))
+    >>> user.gen_master_secret()
+    >>> attr = user.gen_random_attributes(3)
+    >>> n1 = issuer.round_0()
+    >>> (p1, n2) = user.round_1(n1)
+    >>> (signature, P2) = issuer.round_2(p1['U'], p1, attr, n2)
+    >>> (sig, q2Check, c2Check) = user.round_3(signature, P2, n2)
+    >>> credential = {'attributes': attr, 'signature': sig}
+    >>> verifier = Verifier(pk_i, integer(1))
+    >>> nonces = [verifier.get_nonce() for i in range(3)]
+    >>> proofs = [user.build_proof(credential, ['1'], nv) for nv in nonces]
+    >>> verifier.verifyProofs([(credential, ['1'], P, nv) for P, nv in zip(proofs, nonces)])
+    [True, True, True]
+    >>> tampered = dict(proofs[1], s=dict(proofs[1]['s'], v_prime_hat=proofs[1]['s']['v_prime_hat'] + 1))
+    >>> verifier.verifyProofs([(credential, ['1'], P, nv) for P, nv in zip([proofs[0], tampered, proofs[2]], nonces)])
+    [True, False, True]
+    >>> verifier.batch_stats['fallback']
+    True
+    >>> malformed = dict(proofs[1], s=dict(proofs[1]['s']))
+    >>> del malformed['s']['m_hat']
+    >>> verifier.verifyProofs([(credential, ['1'], proofs[0], nonces[0]), (credential, ['1'], malformed, nonces[1]),
+    ...                        (credential, ['1'], {}, nonces[1]), (credential,), (credential, ['1'], proofs[2], nonces[2])])
+    [True, False, False, False, True]
+    >>> verifier.verifyProof(credential, ['1'], malformed, nonces[1])
+    False
+
+    A prover hashing -T instead of its t-value T into the challenge:
+
+    >>> from idemix.provers.cl_prover import CLProver
+    >>> honest = CLProver.prove
+    >>> def negated(self, pk, *args, **kwargs):
+    ...     result = honest(self, pk, *args, **kwargs)
+    ...     return (pk['N'] - result[0], result[1]) if isinstance(result, tuple) else result
+    >>> CLProver.prove = negated
+    >>> forged = user.build_proof(credential, ['1'], nonces[1])
+    >>> CLProver.prove = honest
+    >>> verifier.verifyProof(credential, ['1'], forged, nonces[1])
+    False
+    >>> [verifier.verifyProofs([(credential, ['1'], P, nv) for P, nv in zip([proofs[0], forged, proofs[2]], nonces)])
+    ...  for i in range(8)] == [[True, False, True]] * 8
+    True
+    """
+
+    def __init__(self, pk_i, context, plan_cache_size=64, nonces=None, rng=None):
         self.m = {}
         self.t_values = []
         self.pk_i = pk_i
         self.context = context
+        self.transcript = issuer_transcript(context, pk_i)
+
+        self.bases = None
+        self.plans = collections.OrderedDict()
+        self.plan_cache_size = plan_cache_size
+        self.plan_hits = 0
+        self.plan_misses = 0
+
+        # NonceRegistry or SharedNonceRegistry of the nonces from get_nonce,
+        # None to accept any nonce
+        self.nonces = nonces
+
+        self.domains = DomainBases(pk_i)
+        self.rng = randomness.get(rng)
 
     def get_nonce(self):
-        nv = integer(randomBits(lo))
+        """
+        Returns a new nonce, recorded in the nonce registry if there is one;
+        the registry raises RegistryFull if it has no room for it.
+        """
+        nv = integer(self.rng.randomBits(lo))
+
+        if self.nonces is not None:
+            self.nonces.add(nv)
 
         return nv
 
-    def verifyProof(self, credential, predicate, P, nv):
+    @instrument.step('verifier.verifyProof')
+    def verifyProof(self, credential, predicate, P, nv, predicates=None, domain=None):
+        """
+        Verifies proof P of the attributes predicate disclosed in credential
+        and, if given, of the predicates over hidden attributes (see
+        idemix.provers.predicate_prover) the proof was built with. With a
+        domain, P must also prove that P['common']['nym'] is the pseudonym
+        of the credential's master secret in that domain.
+        """
+        if self.nonces is not None and not self.nonces.consume(nv):
+            return False
+
+        return self.__verify(credential, predicate, P, nv, predicates, domain)
+
+    def __verify(self, credential, predicate, P, nv, predicates=None, domain=None):
+        try:
+            return self.__check(credential, predicate, P, nv, predicates, domain)
+        except malformed:
+            return False
+
+    def __check(self, credential, predicate, P, nv, predicates=None, domain=None):
         T_hat = {}
-        T_hat['t-values'] = self.__verify_cl(credential, predicate, P)
+        T_hat['Z_tilde'] = self.__verify_cl(credential, predicate, P)
 
-        # print "That:", T_hat['t-values']
+        if T_hat['Z_tilde'] is None:
+            return False
 
-        h_challenge = hashlib.new('sha256')
-        h_challenge.update(Conversion.IP2OS(self.context))
-        h_challenge = self.__add_dict_to_hash(P['common'], h_challenge)
-        h_challenge = self.__add_dict_to_hash(T_hat, h_challenge)  # TODO: ricontrollare!
-        h_challenge = self.__add_list_to_hash([], h_challenge)  # committed, representation, nym, dnym, verenc, msg
-        h_challenge.update(Conversion.IP2OS(nv))
-        c = integer(h_challenge.digest())
+        if domain is not None:
+            equation = self.__nym_equation(P, domain)
 
-        return c == P['c']
+            if equation is None:
+                return False
 
-    def __verify_cl(self, credential, predicate, P):
+            T_hat['nym'] = multiexp(equation, self.pk_i['N'])
 
-        A_prime = P['common']['A_prime']
-        m = credential['attributes']
+        equations = self.__predicate_equations(predicate, P, predicates)
+
+        if equations is None:
+            return False
+
+        if equations:
+            T_hat['predicates'] = [dict((name, self.__evaluate(equation)) for name, equation in eqs.items())
+                                   for eqs in equations]
+
+        # print "That:", T_hat['Z_tilde']
+
+        return self.__challenge(P, T_hat, nv) == P['c']
+
+    @instrument.step('verifier.verifyProofs')
+    def verifyProofs(self, batch):
+        """
+        Verifies a batch of (credential, predicate, P, nv) tuples under pk_i,
+        or (credential, predicate, P, nv, predicates, domain) for proofs of
+        predicates or pseudonyms, and returns one boolean per proof, in order.
+
+        Proofs carrying their t-values are first checked against their
+        challenge, then all the equations T_hat == Z_tilde are combined with
+        random odd lo-bit weights into a single check, so every issuer
+        generator is raised only once per batch. If the combined check fails,
+        or a proof cannot be batched, the proofs are verified one by one. A
+        malformed entry, such as a proof missing a field, is False and does
+        not affect the others.
+
+        A claimed t-value off by a factor of order 2, such as -T_hat, is
+        hashed into a valid challenge but raises the combined check by that
+        factor to an odd power, so a single one always fails it; -1 is the
+        only such factor a prover can compute without factoring N. Like any
+        small exponents test, the check cannot see an even number of them in
+        one batch, which cancel out: verifyProofs then accepts proofs that
+        verifyProof rejects, whose responses are still valid up to the sign
+        of their t-values.
+
+        Proofs of Recipient.build_proof carry their 't-values', which the
+        combined check needs; proofs without them are verified one by one.
+
+        With a nonce registry, proofs whose nonce was not handed out by
+        get_nonce, or was already used, are rejected before any other check.
+
+        Size, time and throughput of the last batch are kept in batch_stats.
+        """
+        start = time.time()
+
+        results = [None] * len(batch)
+        fixed = {}
+        own = []
+        claimed = []
+        # domain -> [base, exponent], every domain base is raised once
+        domains = {}
+        # proofs in the combined check, verified one by one if it fails
+        batched = []
+
+        for k, item in enumerate(batch):
+            try:
+                credential, predicate, P, nv, predicates, domain = _batch_item(item)
+
+                if self.nonces is not None and not self.nonces.consume(nv):
+                    results[k] = False
+                    continue
+
+                terms = self.__batch_terms(credential, predicate, P, nv, predicates, domain)
+            except malformed:
+                results[k] = False
+                continue
+
+            if terms is None:
+                results[k] = self.__verify(credential, predicate, P, nv, predicates, domain)
+                continue
+
+            if terms is False:
+                results[k] = False
+                continue
+
+            item_fixed, item_own, item_claimed, item_domain = terms
+
+            for key, e in item_fixed:
+                fixed[key] = fixed.get(key, 0) + e
+            own.extend(item_own)
+            claimed.extend(item_claimed)
+
+            if item_domain is not None:
+                base, e = item_domain
+                entry = domains.setdefault(domain, [base, 0])
+                entry[1] += e
+
+            results[k] = True
+            batched.append(k)
+
+        fallback = False
+
+        if claimed:
+            pairs = [(self.bases[key], exp) for key, exp in fixed.items()]
+            pairs += [(base, exp) for base, exp in domains.values()]
+            lhs = multiexp(claimed, self.pk_i['N'])
+            rhs = multiexp(pairs + own, self.pk_i['N'])
+
+            if lhs != rhs:
+                fallback = True
+                for k in batched:
+                    results[k] = self.__verify(*_batch_item(batch[k]))
+
+        seconds = time.time() - start
+        self.batch_stats = {'proofs': len(batch), 'seconds': seconds, 'fallback': fallback,
+                            'proofs_per_second': len(batch) / seconds if seconds else float('inf')}
+
+        return results
+
+    @instrument.step('verifier.verifyCombinedProof')
+    def verifyCombinedProof(self, parts, P, nv):
+        """
+        Verifies a proof of Recipient.build_combined_proof. parts is a list of
+        (verifier, credential, predicate) in the order of the proof, the
+        verifier holding the issuer key of the credential; the nonce is
+        checked against the registry of self. Ro ** m_hat_0 is computed once
+        per issuer key and shared by its credentials.
+
+        >>> from idemix.issuer import Issuer
+        >>> from idemix.recipient import Recipient
+        >>> def credential(issuer, user):
+        ...     attr = user.gen_random_attributes(2)
+        ...     n1 = issuer.round_0()
+        ...     (p1, n2) = user.round_1(n1)
+        ...     (signature, P2) = issuer.round_2(p1['U'], p1, attr, n2)
+        ...     return {'attributes': attr, 'signature': user.round_3(signature, P2, n2)[0]}
+        >>> issuers = [Issuer(2, 0, 0, 255, integer(k), processes=1) for k in (1, 2)]
+        >>> keys = [issuer.gen_key_pair()[0] for issuer in issuers]
+        >>> users = [Recipient(pk_i, integer(k)) for pk_i, k in zip(keys, (1, 2))]
+        >>> users[0].gen_master_secret()
+        >>> users[1].ms = users[0].ms
+        >>> credentials = [credential(issuer, user) for issuer, user in zip(issuers, users)]
+        >>> stranger = Recipient(keys[1], integer(2))
+        >>> stranger.gen_master_secret()
+        >>> foreign = credential(issuers[1], stranger)
+        >>> verifiers = [Verifier(pk_i, integer(k)) for pk_i, k in zip(keys, (1, 2))]
+        >>> nv = verifiers[0].get_nonce()
+        >>> proven = [(users[0], credentials[0], ['1']), (users[1], credentials[1], ['2'])]
+        >>> P = users[0].build_combined_proof(proven, nv)
+        >>> parts = [(verifiers[0], credentials[0], ['1']), (verifiers[1], credentials[1], ['2'])]
+        >>> verifiers[0].verifyCombinedProof(parts, P, nv)
+        True
+
+        Another proof's m_hat_0, a credential swapped for another one under
+        the same key, or a credential on another master secret fail:
+
+        >>> other = users[0].build_combined_proof(proven, nv)
+        >>> verifiers[0].verifyCombinedProof(parts, dict(P, m_hat_0=other['m_hat_0']), nv)
+        False
+        >>> verifiers[0].verifyCombinedProof([parts[0], (verifiers[1], foreign, ['2'])], P, nv)
+        False
+        >>> mixed = users[0].build_combined_proof([proven[0], (users[1], foreign, ['2'])], nv)
+        >>> verifiers[0].verifyCombinedProof([parts[0], (verifiers[1], foreign, ['2'])], mixed, nv)
+        False
+        """
+        if self.nonces is not None and not self.nonces.consume(nv):
+            return False
+
+        try:
+            return self.__verify_combined(parts, P, nv)
+        except malformed:
+            return False
+
+    def __verify_combined(self, parts, P, nv):
+        proofs = P['proofs']
+
+        if not parts or len(parts) != len(proofs):
+            return False
+
+        shared = {}
+        T_hat = []
+
+        for (verifier, credential, predicate), proof in zip(parts, proofs):
+            part = _combined_part(P, proof)
+            plan = verifier.plan(predicate, part)
+
+            if plan is None:
+                return False
+
+            N = verifier.pk_i['N']
+            exps, proof_term = plan.exponents(credential['attributes'], part)
+
+            if verifier not in shared:
+                shared[verifier] = multiexp([(verifier.bases[('Ro',)], P['m_hat_0'])], N)
+
+            pairs = [(base, exp) for key, base, exp in zip(plan.keys, plan.bases, exps) if key != ('Ro',)]
+            T_hat.append({'Z_tilde': multiexp(pairs + [proof_term], N) * shared[verifier] % N})
+
+        transcript = combined_transcript([verifier.transcript for verifier, credential, predicate in parts])
+
+        return transcript.append([proof['common'] for proof in proofs], T_hat, nv).challenge() == P['c']
+
+    def __batch_terms(self, credential, predicate, P, nv, predicates, domain):
+        """
+        Returns the terms proof P adds to the combined check of verifyProofs,
+        as (fixed, own, claimed, domain) with the (plan_bases key, exponent),
+        (base, exponent) and (t-value, weight) pairs and the (domain base,
+        exponent) of the pseudonym, False if it is invalid, or None if it must
+        be verified on its own: its t-values are missing or do not match its
+        challenge, which does not make the responses wrong. Nothing is added to the batch before every
+        term of P has been computed, so a malformed proof raising on the way
+        leaves the batch untouched.
+        """
+        plan = self.plan(predicate, P)
+        equations = self.__predicate_equations(predicate, P, predicates)
+        nym_equation = None if domain is None else self.__nym_equation(P, domain)
+
+        if plan is None or equations is None or (domain is not None and nym_equation is None):
+            return False
+
+        t_values = P.get('t-values', {})
+        claims = t_values.get('predicates', [])
+
+        if not self.__claimed(t_values.get('Z_tilde')) or len(claims) != len(equations) or \
+                not all(self.__claimed(claim.get(name)) for eqs, claim in zip(equations, claims) for name in eqs) \
+                or (domain is not None and not self.__claimed(t_values.get('nym'))):
+            return None
+
+        if self.__challenge(P, t_values, nv) != P['c']:
+            return None
+
+        fixed = []
+        own = []
+        claimed = []
+        domain_term = None
+
+        r = self.__weight()
+        exps, (base, exp) = plan.exponents(credential['attributes'], P)
+
+        fixed.extend((key, r * e) for key, e in zip(plan.keys, exps))
+        own.append((base, r * exp))
+        claimed.append((t_values['Z_tilde'], r))
+
+        for eqs, claim in zip(equations, claims):
+            for name, (terms, commitments) in eqs.items():
+                r = self.__weight()
+                fixed.extend((key, r * e) for key, e in terms)
+                own.extend((commitment, r * e) for commitment, e in commitments)
+                claimed.append((claim[name], r))
+
+        if domain is not None:
+            (base, m_hat_0), nym_term = nym_equation
+            r = self.__weight()
+            domain_term = (base, r * m_hat_0)
+            own.append((nym_term[0], r * nym_term[1]))
+            claimed.append((t_values['nym'], r))
+
+        return fixed, own, claimed, domain_term
+
+    def __weight(self):
+        'Odd lo-bit weight of an equation in the combined check'
+        return integer(self.rng.randomBits(lo) | 1)
+
+    def __predicate_equations(self, predicate, P, predicates):
+        """
+        Returns the equations of the predicate proofs in P, one dict per
+        predicate, or None if P does not prove exactly predicates over hidden
+        attributes.
+        """
+        predicates = predicates or []
+        common = P['common'].get('predicates', [])
+        s = P['s'].get('predicates', [])
         m_hat = P['s']['m_hat']
-        e_hat = P['s']['e_hat']
-        v_prime_hat = P['s']['v_prime_hat']
-        c = P['c']
 
-        Rtot = 1 % self.pk_i['N']
-        Rtot_hat = 1 % self.pk_i['N']
+        if len(common) != len(predicates) or len(s) != len(predicates):
+            return None
+
+        equations = []
+        for p, common_value, s_values in zip(predicates, common, s):
+            if p.get('type') not in provers or p['index'] in predicate or p['index'] not in m_hat:
+                return None
+            equations.append(_predicate_equations(p, common_value, s_values, m_hat[p['index']], P['c']))
+
+        return equations
 
-        for id in predicate:
-            Rtot = Rtot * (self.pk_i['R'][id] ** m[id])
+    def __nym_equation(self, P, domain):
+        """
+        Returns the (base, exponent) pairs of the pseudonym t-value,
+        g_dom ** m_hat_0 * nym ** -c, or None if P carries no valid pseudonym.
+        """
+        nym = P['common'].get('nym')
 
-        for id, v in m_hat.iteritems():
-            if id is not '0':
-                Rtot_hat = Rtot_hat * (self.pk_i['R'][id] ** m_hat[id])
-        Rtot_hat = Rtot_hat * (self.pk_i['Ro'] ** m_hat['0'])
+        if not self.__claimed(nym):
+            return None
 
-        den = Rtot * (A_prime ** (2 ** (le - 1)))
-        T_hat_1 = (self.pk_i['Z'] / den) ** (-1 * c)
-        T_hat_2 = A_prime ** e_hat
-        T_hat_3 = self.pk_i['S'] ** v_prime_hat
+        return [(self.domains.base(domain), P['s']['m_hat']['0']), (nym, -1 * P['c'])]
 
-        T_hat = (T_hat_1 * T_hat_2 * Rtot_hat * T_hat_3) % self.pk_i['N']
+    def __evaluate(self, equation):
+        terms, commitments = equation
+
+        return multiexp([(self.bases[key], e) for key, e in terms] + commitments, self.pk_i['N'])
+
+    def __claimed(self, t_value):
+        return t_value is not None and 0 < int(t_value) < int(self.pk_i['N'])
+
+    def __challenge(self, P, t_values, nv):
+        return self.transcript.copy().append(P['common'], t_values, nv).challenge()
+
+    def __verify_cl(self, credential, predicate, P):
+        plan = self.plan(predicate, P)
+
+        if plan is None:
+            return None
+
+        T_hat = plan.evaluate(credential['attributes'], P, self.pk_i['N'])
 
         # TODO: check lengths
 
         return T_hat
 
-    def __add_list_to_hash(self, list_obj, hash_obj):
-        for e in list_obj:
-            hash_obj.update(Conversion.IP2OS(e))
-        return hash_obj
-
-    def __add_dict_to_hash(self, dict_obj, hash_obj):
-        for k, v in dict_obj.iteritems():
-            hash_obj.update(Conversion.IP2OS(v))
-
-        return hash_obj
-
-        # def verifyAllIRMA_NYM_ONLY(self, m, input):
-        #     pAprime = input['pAprime']
-        #     pChat = input['pChat']
-        #     pEhat = input['pEhat']
-        #     mHatMs = input['mHatMs']
-        #     pVprimeHat = input['pVprimeHat']
-        #     n3 = input['n3']
-        #     NYM1 = input['NYM1']
-        #     NYM2 = input['NYM2']
-        #
-        #     Ak = 1 % self.pk_i['N']
-        #     R = self.pk_i['R']
-        #
-        #     for i in range(1, len(m) + 1):
-        #         Ak = Ak * (R[str(i)] ** m[str(i)])
-        #
-        #     That1 = (self.pk_i['Z'] / (Ak * (pAprime ** (2 ** (le - 1))))) ** ((-1 * pChat)) % self.pk_i['N']
-        #     That2 = (pAprime ** pEhat) * (self.pk_i['Ro'] ** mHatMs) * (self.pk_i['S'] ** pVprimeHat) % self.pk_i['N']
-        #
-        #     That = (That1 * That2) % self.pk_i['N']
-        #
-        #     ## challenge
-        #
-        #     s6 = hashlib.new('sha256')
-        #
-        #     s6.update(Conversion.IP2OS(NYM2))
-        #     s6.update(Conversion.IP2OS(NYM1))
-        #     s6.update(Conversion.IP2OS(self.context))
-        #     s6.update(Conversion.IP2OS(pAprime))
-        #
-        #     s6.update(Conversion.IP2OS(That))
-        #
-        #     pChat2 = integer(s6.digest())
-        #
-        #     return pChat == pChat2
-        #
-        # def verifyAllIRMA_NYM_H_ONLY(self, m, input):
-        #     pAprime = input['pAprime']
-        #     pChat = input['pChat']
-        #     pEhat = input['pEhat']
-        #     mHatMs = input['mHatMs']
-        #     pVprimeHat = input['pVprimeHat']
-        #     n3 = input['n3']
-        #     NYM1 = input['NYM1']
-        #     NYM2 = input['NYM2']
-        #
-        #     mHat1 = m['1'] % self.pk_i['N']
-        #
-        #     Ak = 1 % self.pk_i['N']
-        #     R = self.pk_i['R']
-        #
-        #     Ak = Ak * (R['1'] ** mHat1)
-        #
-        #     That1 = (self.pk_i['Z'] / (Ak * (pAprime ** (2 ** (le - 1))))) ** ((-1 * pChat)) % self.pk_i['N']
-        #     That2 = (pAprime ** pEhat) * (self.pk_i['Ro'] ** mHatMs) * (R['2'] ** m['2']) * (R['3'] ** m['3']) * (
-        #         R['4'] ** m['4']) * (R['5'] ** m['5']) * (self.pk_i['S'] ** pVprimeHat) % self.pk_i['N']
-        #
-        #     ThatCred1 = (That1 * That2) % self.pk_i['N']
-        #
-        #     ## challenge
-        #
-        #     s6 = hashlib.new('sha256')
-        #
-        #     s6.update(Conversion.IP2OS(NYM2))
-        #     s6.update(Conversion.IP2OS(NYM1))
-        #     s6.update(Conversion.IP2OS(self.context))
-        #     s6.update(Conversion.IP2OS(pAprime))
-        #
-        #     s6.update(Conversion.IP2OS(ThatCred1))
-        #
-        #     pChat2 = integer(s6.digest())
-        #
-        #     return pChat == pChat2
+    def plan(self, predicate, P):
+        """
+        Returns the VerificationPlan of proof P disclosing predicate, or None
+        if the disclosed and the hidden attributes overlap or are not in pk_i.
+        Plans are kept per (disclosed, hidden) shape in an LRU of
+        plan_cache_size entries.
+        """
+        shape = (frozenset(predicate), frozenset(id for id in P['s']['m_hat'] if id != '0'))
+
+        plan = self.plans.pop(shape, None)
+
+        if plan is not None:
+            self.plan_hits += 1
+            self.plans[shape] = plan
+            return plan
+
+        disclosed, hidden = shape
+
+        if disclosed & hidden or not disclosed | hidden <= set(self.pk_i['R']):
+            return None
+
+        if self.bases is None:
+            self.bases = plan_bases(self.pk_i)
+
+        self.plan_misses += 1
+        plan = self.plans[shape] = VerificationPlan(self.bases, disclosed, hidden)
+
+        while len(self.plans) > self.plan_cache_size:
+            self.plans.popitem(last=False)
+
+        return plan
 
 
 def SHA1(bytes1):
@@ -177,5 +617,5 @@ def SHA1(bytes1):
     return s1.digest()
 
 
-def randomQR(n):
-    return random(n) ** 2
+def randomQR(n, rng=None):
+    return instrument.modexp(randomness.get(rng).random(n), 2, n)
@@ -0,0 +1,409 @@
+"""
+Copyright (c) 2013-2016 Antonio de la Piedra, Alberto Caponi, Claudio Pisa
+Original code from Antonio de la Piedra: https://github.com/adelapie/irma_phase_2/tree/master/terminal
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+'''
+Asyncio verifier service (Python 3.7+)
+
+Frames on the socket are a 4-byte big-endian length followed by the payload.
+Requests:
+
+    b'N'                        issue a nonce
+    b'V' + presentation         verify a wire-encoded 'presentation'
+                                {'attributes': ..., 'proof': ..., 'nonce': ...}
+
+Replies start with a status byte (see the constants below); a nonce reply
+is followed by the wire-encoded nonce, or is BUSY alone when the nonce
+registry is full.
+
+Nonces are kept in a NonceRegistry, or in the registry passed as `nonces`:
+a SharedNonceRegistry created before forking lets several service
+processes, e.g. listening on the same port, accept each other's nonces. A
+replayed or unknown nonce is answered INVALID before the proof is queued.
+
+Proofs arriving within `window` seconds are verified together, up to
+`max_batch` of them, with Verifier.verifyProofs in a process pool. When
+`queue_size` proofs are already waiting new ones are answered BUSY, and
+their nonce is left unused so that they can be sent again. A presentation
+missing one of the fields of a proof is answered BAD_REQUEST on its own;
+it never shares a batch with other proofs.
+'''
+
+import asyncio
+import concurrent.futures
+import os
+import struct
+
+from idemix.utils import wire
+from idemix.utils.arith import integer
+from idemix.utils.key_bundle import dump_key_bundle, load_key_bundle
+from idemix.utils.nonce_registry import NonceRegistry, RegistryFull
+from idemix.verifier import Verifier
+
+INVALID = 0
+VALID = 1
+BUSY = 2
+BAD_REQUEST = 3
+
+frame_header = struct.Struct('>I')
+max_frame = 1 << 20
+
+
+class VerifierService:
+    """
+    Idemix verifier service
+
+    >>> from idemix.issuer import Issuer
+    >>> from idemix.recipient import Recipient
+    >>> issuer = Issuer(3, 0, 0, 255, integer(1), processes=1)
+    >>> (pk_i, sk_i) = issuer.gen_key_pair()
+    >>> user = Recipient(pk_i, integer(1))
+    >>> user.gen_master_secret()
+    >>> attr = user.gen_random_attributes(3)
+    >>> n1 = issuer.round_0()
+    >>> (p1, n2) = user.round_1(n1)
+    >>> (signature, P2) = issuer.round_2(p1['U'], p1, attr, n2)
+    >>> (sig, q2Check, c2Check) = user.round_3(signature, P2, n2)
+    >>> credential = {'attributes': attr, 'signature': sig}
+
+    Over loopback, a proof missing m_hat only fails its own request:
+
+    >>> async def present(port, broken):
+    ...     client = await open_verifier_connection('127.0.0.1', port)
+    ...     nv = await client.get_nonce()
+    ...     proof = user.build_proof(credential, ['1'], nv)
+    ...     if broken:
+    ...         del proof['s']['m_hat']
+    ...     status = await client.verify({'1': attr['1']}, proof, nv)
+    ...     client.close()
+    ...     return status
+    >>> async def serve():
+    ...     service = VerifierService(pk_i, integer(1), processes=1, window=0.2)
+    ...     (host, port) = await service.start()
+    ...     statuses = await asyncio.gather(*[present(port, k == 2) for k in range(4)])
+    ...     await service.close()
+    ...     return statuses
+    >>> asyncio.run(serve()) == [VALID, VALID, BAD_REQUEST, VALID]
+    True
+
+    A proof answered BUSY keeps its nonce, and close() cancels the proofs
+    that are still waiting:
+
+    >>> async def busy():
+    ...     service = VerifierService(pk_i, integer(1), processes=1, window=5, queue_size=1)
+    ...     await service.start()
+    ...     nonces = [service.get_nonce() for k in range(2)]
+    ...     proofs = [user.build_proof(credential, ['1'], nv) for nv in nonces]
+    ...     first = asyncio.ensure_future(service.verify({'1': attr['1']}, proofs[0], nonces[0]))
+    ...     second = asyncio.ensure_future(service.verify({'1': attr['1']}, proofs[1], nonces[1]))
+    ...     await asyncio.sleep(0.1)
+    ...     again = asyncio.ensure_future(service.verify({'1': attr['1']}, proofs[1], nonces[1]))
+    ...     await asyncio.sleep(0.1)
+    ...     await service.close()
+    ...     await asyncio.sleep(0)
+    ...     return second.result(), first.cancelled(), again.cancelled()
+    >>> asyncio.run(busy()) == (BUSY, True, True)
+    True
+
+    A nonce that could not be recorded is never handed out:
+
+    >>> async def full():
+    ...     service = VerifierService(pk_i, integer(1), processes=1, nonces=NonceRegistry(capacity=1))
+    ...     (host, port) = await service.start()
+    ...     client = await open_verifier_connection('127.0.0.1', port)
+    ...     nonces = [await client.get_nonce() for k in range(2)]
+    ...     client.close()
+    ...     await service.close()
+    ...     return nonces[0] is not None, nonces[1]
+    >>> asyncio.run(full())
+    (True, None)
+
+    In the workers, messages that cannot be decoded or lack a field of the
+    proof are answered BAD_REQUEST and the others are still verified:
+
+    >>> _init_worker(dump_key_bundle(pk_i), 1)
+    >>> def message(proof, nv):
+    ...     return wire.encode('presentation', {'attributes': {'1': attr['1']}, 'proof': proof, 'nonce': nv})
+    >>> good = user.build_proof(credential, ['1'], 7)
+    >>> tampered = dict(good, c=good['c'] + 1)
+    >>> broken = dict(good, s={})
+    >>> _verify_batch([message(good, 7), b'garbage', message(broken, 7), message(tampered, 7), message(good, 7)]) == \\
+    ...     [VALID, BAD_REQUEST, BAD_REQUEST, INVALID, VALID]
+    True
+    """
+
+    def __init__(self, pk_i, context, processes=None, window=0.005, max_batch=64, queue_size=1024,
+                 nonce_ttl=300, nonces=None):
+        self.pk_i = pk_i
+        self.context = context
+        self.window = window
+        self.max_batch = max_batch
+        self.queue_size = queue_size
+        self.nonce_ttl = nonce_ttl
+
+        self.nonces = NonceRegistry(nonce_ttl) if nonces is None else nonces
+        self.verifier = Verifier(pk_i, context, nonces=self.nonces)
+
+        self.processes = processes
+        self.executor = None
+        self.queue = None
+        self.slots = None
+        self.batcher = None
+        # the batch being collected, and the batches being verified
+        self.collecting = []
+        self.running = set()
+        self.server = None
+        self.connections = set()
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Starts the worker pool and the server, returns the bound address"""
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            self.processes, initializer=_init_worker, initargs=(dump_key_bundle(self.pk_i), int(self.context)))
+        self.queue = asyncio.Queue(self.queue_size)
+        self.slots = asyncio.Semaphore(self.processes or os.cpu_count())
+        self.batcher = asyncio.ensure_future(self.__batch_loop())
+        self.server = await asyncio.start_server(self.__handle, host, port)
+
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+        for writer in list(self.connections):
+            writer.close()
+        await asyncio.sleep(0)
+
+        if self.batcher is not None:
+            self.batcher.cancel()
+            self.batcher = None
+
+        if self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+
+        # proofs that will not be verified any more
+        pending = self.collecting
+        self.collecting = []
+        while self.queue is not None and not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+
+        for message, future in pending:
+            future.cancel()
+
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def get_nonce(self):
+        """Returns a new nonce, raises RegistryFull if it could not be recorded"""
+        return self.verifier.get_nonce()
+
+    def consume_nonce(self, nv):
+        return self.nonces.consume(nv)
+
+    async def verify(self, attributes, proof, nv):
+        """
+        Verifies a proof for the disclosed attributes and a nonce issued by
+        get_nonce. Returns VALID, INVALID, BUSY or BAD_REQUEST. The nonce is
+        only used up once the proof is queued, so a proof answered BUSY can
+        be sent again.
+        """
+        if not _well_formed(attributes, proof):
+            return BAD_REQUEST
+
+        if self.queue.full():
+            return BUSY
+
+        if not self.consume_nonce(nv):
+            return INVALID
+
+        future = asyncio.get_event_loop().create_future()
+        message = wire.encode('presentation', {'attributes': attributes, 'proof': proof, 'nonce': nv})
+        self.queue.put_nowait((message, future))
+
+        return await future
+
+    async def __batch_loop(self):
+        loop = asyncio.get_event_loop()
+
+        while True:
+            await self.slots.acquire()
+
+            batch = self.collecting = [await self.queue.get()]
+            deadline = loop.time() + self.window
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.collecting = []
+            task = asyncio.ensure_future(self.__run_batch(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def __run_batch(self, batch):
+        loop = asyncio.get_event_loop()
+
+        try:
+            results = await loop.run_in_executor(self.executor, _verify_batch, [message for message, future in batch])
+        except Exception as e:
+            for message, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (message, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.slots.release()
+
+    async def __handle(self, reader, writer):
+        self.connections.add(writer)
+
+        try:
+            while True:
+                (length,) = frame_header.unpack(await reader.readexactly(frame_header.size))
+                if length > max_frame:
+                    break
+
+                reply = await self.__reply(await reader.readexactly(length))
+
+                writer.write(frame_header.pack(len(reply)) + reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def __reply(self, frame):
+        op = frame[:1]
+
+        if op == b'N':
+            try:
+                return bytes([VALID]) + wire.encode('nonce', self.get_nonce())
+            except RegistryFull:
+                return bytes([BUSY])
+
+        if op == b'V':
+            try:
+                kind, message = wire.decode(memoryview(frame)[1:], self.pk_i['N'], 'presentation')
+                status = await self.verify(message['attributes'], message['proof'], message['nonce'])
+            except (ValueError, KeyError, TypeError):
+                status = BAD_REQUEST
+            return bytes([status])
+
+        return bytes([BAD_REQUEST])
+
+
+class VerifierClient:
+    'Client of a VerifierService'
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.lock = asyncio.Lock()
+
+    async def __request(self, frame):
+        async with self.lock:
+            self.writer.write(frame_header.pack(len(frame)) + frame)
+            await self.writer.drain()
+            (length,) = frame_header.unpack(await self.reader.readexactly(frame_header.size))
+
+            return await self.reader.readexactly(length)
+
+    async def get_nonce(self):
+        """Returns a nonce of the service, None if it is busy"""
+        reply = await self.__request(b'N')
+
+        if reply[0] != VALID:
+            return None
+
+        return wire.decode(reply[1:], kind='nonce')[1]
+
+    async def verify(self, attributes, proof, nv):
+        message = wire.encode('presentation', {'attributes': attributes, 'proof': proof, 'nonce': nv})
+
+        return (await self.__request(b'V' + message))[0]
+
+    def close(self):
+        self.writer.close()
+
+
+async def open_verifier_connection(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+
+    return VerifierClient(reader, writer)
+
+
+# Worker side: every process loads the public key once
+
+_worker_verifier = None
+
+
+def _init_worker(bundle, context):
+    global _worker_verifier
+
+    pk_i, sk_i = load_key_bundle(bundle)
+    _worker_verifier = Verifier(pk_i, integer(context))
+
+
+def _well_formed(attributes, proof):
+    'True if proof has the fields of a proof of Recipient.build_proof disclosing attributes'
+    return isinstance(attributes, dict) and isinstance(proof, dict) and \
+        isinstance(proof.get('s'), dict) and isinstance(proof['s'].get('m_hat'), dict) and \
+        isinstance(proof.get('common'), dict) and 'c' in proof and \
+        all(name in proof['s'] for name in ('e_hat', 'v_prime_hat')) and '0' in proof['s']['m_hat'] and \
+        'A_prime' in proof['common']
+
+
+def _verify_batch(messages):
+    """
+    Returns the status of every message. A message that cannot be decoded,
+    or whose proof is missing a field, is BAD_REQUEST and the others are
+    verified together.
+    """
+    N = _worker_verifier.pk_i['N']
+    statuses = [BAD_REQUEST] * len(messages)
+    batch = []
+    positions = []
+
+    for k, message in enumerate(messages):
+        try:
+            kind, presentation = wire.decode(message, N, 'presentation')
+            attributes = presentation['attributes']
+            proof = presentation['proof']
+            nv = presentation['nonce']
+        except (ValueError, KeyError, TypeError):
+            continue
+
+        if not _well_formed(attributes, proof):
+            continue
+
+        batch.append(({'attributes': attributes}, list(attributes), proof, nv))
+        positions.append(k)
+
+    for k, result in zip(positions, _worker_verifier.verifyProofs(batch)):
+        statuses[k] = VALID if result else INVALID
+
+    return statuses
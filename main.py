@@ -18,12 +18,10 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import hashlib
 
-from charm.core.math.integer import integer, randomBits
-from charm.toolbox.conversion import Conversion
-
 from idemix.issuer import Issuer
 from idemix.recipient import Recipient
 from idemix.settings import lm, l, secparam
+from idemix.utils.arith import integer, randomBits
 from idemix.verifier import Verifier
 
 context = integer(randomBits(lm))
@@ -32,7 +30,7 @@ attr = {'1': 'student', '2': 'italian', '3': 'age'}
 for id, value in attr.iteritems():
     h_challenge = hashlib.new('sha256')
     h_challenge.update(str(value))
-    attr[id] = Conversion.bytes2integer(h_challenge.digest())
+    attr[id] = integer(h_challenge.digest())
 
 issuer = Issuer(len(attr), 0, 0, secparam, context)
 pk_i, sk_i = issuer.gen_key_pair()